@@ -16,7 +16,7 @@ setup(
     description='A command line tool to manage a PubMed DB mirror.',
     long_description=long_description,
     install_requires=[
-        'sqlalchemy >= 0.8',
+        'sqlalchemy >= 1.2',
     ],
     py_modules=['medic'],
     packages=[
@@ -0,0 +1,167 @@
+"""
+.. py:module:: medic.checkpoint
+   :synopsis: Checkpoints to resume interrupted exports.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+"""
+import json
+import logging
+import os
+
+from hashlib import sha1
+
+from medic.pmids import AsPmids
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = 999
+"Number of records written between checkpoints (one page or batch of records)."
+
+MAX_PMID = 2 ** 63 - 1
+"The upper PMID bound when resuming (the largest BIGINT)."
+
+
+def Selection(pmids, where: list=()) -> str:
+    """
+    Return a digest identifying a selection of records: the *pmids* (see
+    `medic.pmids.AsPmids`) and the SQL *where* predicates (see
+    `medic.crud.filters`).
+    """
+    digest = sha1(AsPmids(pmids))
+
+    for clause in where:
+        compiled = clause.compile()
+        digest.update(str(compiled).encode('utf-8'))
+        digest.update(repr(sorted(compiled.params.items())).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """
+    The progress of an export to an `output` file, persisted to the output
+    file name plus ".checkpoint" every `interval` records (see `track`): the
+    last fully written PMID, the output's byte offset after it, and the
+    number of records written, together with the `output_format` and the
+    `selection` of records (see `Selection`) to ensure a resumed export
+    continues the same one.
+
+    Resuming truncates the `output` to the checkpointed offset (see `open`)
+    and continues after the checkpointed PMID (see `bounds`), relying on the
+    records to be written in PMID order, so the result is identical to an
+    uninterrupted export; the checkpoint is removed when the export is
+    `finish`\\ ed.
+    """
+
+    def __init__(self, output: str, output_format: str, selection: str,
+                 interval: int=INTERVAL):
+        self.output = output
+        self.path = output + '.checkpoint'
+        self.interval = interval
+        self.format = output_format
+        self.selection = selection
+        self.pmid = None
+        self.offset = 0
+        self.records = 0
+        self.stream = None
+
+    @property
+    def resumed(self) -> bool:
+        """``True`` if some records have been written already."""
+        return self.pmid is not None
+
+    @property
+    def bounds(self) -> tuple:
+        """The PMID bounds of the remaining records (or ``None`` if not resumed)."""
+        return (self.pmid + 1, MAX_PMID) if self.resumed else None
+
+    def load(self) -> bool:
+        """
+        Load an existing checkpoint and return ``True`` if the export resumes.
+
+        :raises ValueError: if the checkpoint is of a different export
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path) as file:
+            state = json.load(file)
+
+        if state['format'] != self.format or state['selection'] != self.selection:
+            raise ValueError('{} is a checkpoint of a different export ({} format)'.format(
+                self.path, state['format']
+            ))
+
+        self.pmid, self.offset, self.records = state['pmid'], state['offset'], state['records']
+        logger.info("resuming %s after PMID %s (%i records, %i bytes)",
+                    self.output, self.pmid, self.records, self.offset)
+        return self.resumed
+
+    def open(self, encoding: str='utf-8'):
+        """
+        Open the `output` for writing: a new file or, if resumed, the
+        existing file truncated to the checkpointed offset.
+
+        :raises ValueError: if the output is shorter than the checkpointed offset
+        """
+        if not self.resumed:
+            return open(self.output, 'wt', encoding=encoding)
+
+        size = os.path.getsize(self.output) if os.path.exists(self.output) else -1
+
+        if size < self.offset:
+            raise ValueError('{} is shorter than the checkpoint ({} bytes)'.format(
+                self.output, self.offset
+            ))
+
+        os.truncate(self.output, self.offset)
+        return open(self.output, 'at', encoding=encoding)
+
+    def track(self, records: iter) -> iter:
+        """
+        Yield the *records*, checkpointing every `interval` records once the
+        consumer requests the next one (i.e., has written the previous one)
+        to the `stream` (the open output file or a
+        `medic.crud.BackgroundWriter` of it; see `mark`).
+        """
+        count = 0
+
+        for record in records:
+            yield record
+            count += 1
+
+            if count % self.interval == 0:
+                self.mark(record.pmid, self.records + count)
+
+    def mark(self, pmid: int, records: int):
+        """Save a checkpoint after the *pmid* once the `stream` is flushed."""
+        stream = self.stream
+        save = lambda: self.save(pmid, _file(stream).buffer.tell(), records)
+
+        if hasattr(stream, 'mark'):
+            stream.mark(save)
+        else:
+            stream.flush()
+            save()
+
+    def save(self, pmid: int, offset: int, records: int):
+        """Atomically replace the checkpoint file with this state."""
+        temporary = self.path + '.tmp'
+
+        with open(temporary, 'w') as file:
+            json.dump(dict(format=self.format, selection=self.selection, pmid=pmid,
+                           offset=offset, records=records), file)
+
+        os.replace(temporary, self.path)
+        logger.debug("checkpoint after PMID %i at %i bytes", pmid, offset)
+
+    def finish(self):
+        """Remove the checkpoint of the completed export."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _file(stream):
+    """Return the file a (background) *stream* writes to."""
+    return getattr(stream, 'file', stream)
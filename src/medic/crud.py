@@ -6,71 +6,628 @@
 .. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
 """
 import logging
-
-from functools import partial
-from itertools import chain
+import re
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque, Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from io import StringIO, TextIOBase
+from itertools import chain, islice
+from multiprocessing import Process, Queue as ProcessQueue
+from queue import Queue, Empty, Full
+from threading import Event, Thread
+from time import time
 from gzip import open as gunzip
-from os import remove
-from os.path import join
+from os import listdir, remove
+from os.path import basename, join
+from sqlalchemy import and_, bindparam, func, literal, union, select as sql_select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.exc import IntegrityError, DatabaseError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.schema import Column, MetaData, Table
+from sqlalchemy.types import BigInteger, UnicodeText
 
-from medic.orm import Citation, Section, Abstract, Author, Descriptor, \
-    Qualifier, Database, Identifier, Chemical, Keyword, PublicationType
+from medic.orm import InitDb, Session as NewSession, Citation, Section, Abstract, Author, Descriptor, \
+    Qualifier, Database, Identifier, Chemical, Keyword, PublicationType, \
+    Fingerprint, Statistic, UpdateFile, AsRow, InLimit, QUERY_LIMIT
 from medic.parser import MedlineXMLParser, PubMedXMLParser, Parser
+from medic.pmids import Sorted, SEQUENCES, TYPECODE
 from medic.web import Download
 from sqlalchemy.sql import operators
 
 logger = logging.getLogger(__name__)
 
-QUERY_LIMIT = 999
-"Maximum number of parameters that can be in an SQLite query; default is 999."
+CORE_BATCH_SIZE = 1000
+"Default number of citations per ``executemany`` batch for the Core engine."
+
+
+ENGINES = ('orm', 'core')
+"Available insert engines: ORM (`Session.add`) or Core (``executemany``)."
+
+ALL_RELATIONS = (
+    'abstracts.sections', 'authors', 'chemicals', 'databases', 'descriptors.qualifiers',
+    'identifiers', 'keywords', 'publication_types'
+)
+WRITE_RELATIONS = {
+    'medline': ALL_RELATIONS,
+    'full': ALL_RELATIONS,
+    'html': ALL_RELATIONS,
+    'jsonl': ALL_RELATIONS,
+    'tsv': ('abstracts.sections',),
+    'tiab': ('abstracts.sections',),
+}
+"The `Citation` relations each output format of ``medic write`` uses (see `select`)."
+
+WORKER_QUEUE_SIZE = 100
+"Maximum number of parsed citations queued for each parallel update worker."
+
+END_OF_FILE = 'EOF'
+"Queued to each parallel update worker after the citations of every file (see `_updateWorker`)."
+
+
+def insert(session: Session, files_or_pmids: iter, uniq: bool,
+           batch_size: int=0, engine: str='orm', queue_size: int=0,
+           reject_file: str=None) -> bool:
+    """
+    Insert all records by parsing the *files* or downloading the *PMIDs*.
+
+    If a *batch_size* is given, the session is committed (and emptied)
+    every *batch_size* citations, otherwise only once at the very end.
+    With the ``'core'`` *engine*, the rows are bulk-loaded with Core
+    ``executemany`` statements (see `Citation.insert`) instead of the ORM,
+    in batches of *batch_size* (or `CORE_BATCH_SIZE`) citations.
+    If a *queue_size* is given, parsing runs in a background thread that
+    queues up to *queue_size* citations for the DB (see `_Pipeline`).
+    If a *reject_file* is given, citations that cannot be written (e.g.,
+    duplicates) are written to that file with their error, while all
+    other citations are loaded (see `_Loader`).
+    """
+    if engine == 'core':
+        loader = _CoreLoader(session, batch_size, reject_file)
+    elif engine == 'orm':
+        loader = _Loader(session, lambda i: session.add(i), batch_size, reject_file)
+    else:
+        logger.critical("unknown insert engine %s", repr(engine))
+        return False
+
+    return _add(session, files_or_pmids, loader, uniq, queue_size)
+
 
+def update(session: Session, files_or_pmids: iter, uniq: bool,
+           batch_size: int=0, queue_size: int=0, workers: int=0,
+           partitions: list=None, reject_file: str=None) -> bool:
+    """
+    Update all records in the *files* (paths) or download the *PMIDs*.
+
+    Citations that have not changed (see `Fingerprint`) are not written.
+    See `insert` for the meaning of *batch_size*, *queue_size*, and
+    *reject_file* (which is not supported with *workers*).
+    With more than one *workers*, the citations are partitioned by PMID
+    (``pmid % workers``) across as many processes (see `_updatePartitions`);
+    a list of *partitions* restricts the update to those partitions only
+    (e.g., to retry a failed partition).
+    """
+    if workers and workers > 1:
+        url = session.get_bind().url
 
-def insert(session: Session, files_or_pmids: iter, uniq: bool) -> bool:
-    """Insert all records by parsing the *files* or downloading the *PMIDs*."""
-    _add(session, files_or_pmids, lambda i: session.add(i), uniq)
+        if url.get_dialect().name != 'sqlite':
+            # do not let the forked workers inherit any pooled connections
+            session.close()
+            session.get_bind().dispose()
+            return _updatePartitions(url, files_or_pmids, uniq, batch_size,
+                                     workers, partitions)
 
+        logger.warning('SQLite does not support concurrent writers; '
+                       'updating all partitions in one process')
 
-def update(session: Session, files_or_pmids: iter, uniq: bool) -> bool:
-    """Update all records in the *files* (paths) or download the *PMIDs*."""
-    _add(session, files_or_pmids, lambda i: session.merge(i), uniq)
+    loader = _UpdateLoader(session, batch_size, reject_file)
+    return _add(session, files_or_pmids, loader, uniq, queue_size)
 
 
-def select(session: Session, pmids: list([int])) -> iter([Citation]):
-    """Return an iterator over all `Citation` records for a list of *PMIDs*."""
+def select(session: Session, pmids: list([int]), relations: iter=(),
+           snapshot: bool=False, bounds: tuple=None, where: list=()) -> iter([Citation]):
+    """
+    Return an iterator over all `Citation` records, ordered by PMID, for a
+    list of *PMIDs* (or all records, if the list is empty), optionally
+    only within the (inclusive) PMID *bounds* (see `partition`) and only
+    those that match all *where* predicates (see `filters`).
+
+    The *PMIDs* can be any sequence, like a compact PMID array or a
+    memory-mapped binary PMID list (see `medic.pmids`), as they are only
+    sliced into chunks of as many PMIDs as fit next to the parameters of the
+    *bounds* and *where* predicates (see `medic.orm.InLimit`).
+
+    The *relations* (e.g., ``'abstracts.sections'``; see `WRITE_RELATIONS`)
+    of the records are eagerly loaded with one ``SELECT ... IN`` query per
+    relation and chunk of `QUERY_LIMIT` records, instead of lazily (i.e.,
+    one query per relation and record).
+
+    All records are read in pages of `QUERY_LIMIT` records (see `_pages`);
+    with *snapshot* (PostgreSQL only), they are streamed from a server-side
+    cursor in a single ``REPEATABLE READ`` transaction instead (see
+    `_snapshot`), for a consistent view of the whole DB.
+    """
     count = 0
     offset = 0
+    query = session.query(Citation).options(*map(_eagerLoad, relations))
+    where = list(where)
+
+    if bounds:
+        where.append(Citation.pmid.between(*bounds))
+
+    if where:
+        query = query.filter(*where)
 
     if pmids:
-        logger.debug("query %s records (limit: %s)", len(pmids), QUERY_LIMIT)
+        limit = InLimit(where)
+
+        if bounds:
+            pmids = Sorted(pmids)
+            pmids = pmids[bisect_left(pmids, bounds[0]):bisect_right(pmids, bounds[1])]
+
+        logger.debug("query %s records (limit: %s)", len(pmids), limit)
 
         while offset < len(pmids):
-            for record in session.query(Citation).filter(
-                    Citation.pmid.in_(pmids[offset:offset + QUERY_LIMIT])
-            ):
+            for record in query.filter(
+                    Citation.pmid.in_(pmids[offset:offset + limit])
+            ).order_by(Citation.pmid):
                 count += 1
                 yield record
 
-            offset += QUERY_LIMIT
+            offset += limit
     else:
-        logger.debug("query all records (yielding: %s)", QUERY_LIMIT)
+        if snapshot and session.get_bind().dialect.name != 'postgresql':
+            logger.warning('snapshots are only supported by PostgreSQL')
+            snapshot = False
+
+        logger.debug("query all records (%s: %s)",
+                     'yielding' if snapshot else 'page size', QUERY_LIMIT)
 
-        for record in session.query(Citation).yield_per(QUERY_LIMIT):
+        for record in (_snapshot if snapshot else _pages)(session, query):
             count += 1
             yield record
 
     logger.info("retrieved %i records", count)
 
 
-def delete(session: Session, pmids: list([int])) -> bool:
-    """Delete all records for a list of *PMIDs*."""
+def partition(session: Session, pmids: list([int]), parts: int, where: list=()) -> list:
+    """
+    Split a list of *PMIDs* (or all PMIDs, if the list is empty) into at
+    most as many contiguous *parts* with about the same number of records
+    (that match all *where* predicates, for all PMIDs; see `filters`).
+
+    :return: a list of sorted PMID sequences or, for all PMIDs, of inclusive
+             ``(first, last)`` PMID bounds (see `select`), in PMID order
+    """
     if pmids:
-        count = session.query(Citation).filter(Citation.pmid.in_(pmids)).delete(
-            synchronize_session=False
-        )
-    elif isinstance(pmids, list) and len(pmids) == 0:
-        count = session.query(Citation).delete(synchronize_session=False)
+        pmids = Sorted(pmids)
+        size = -(-len(pmids) // parts)
+        return [pmids[offset:offset + size] for offset in range(0, len(pmids), size)]
+
+    conn = session.connection()
+    pmid = Citation.__table__.c.pmid
+    matches = and_(*where)
+    total, last = conn.execute(
+        sql_select([func.count(), func.max(pmid)]).where(matches)
+    ).first()
+    starts = []
+
+    for part in range(parts):
+        start = conn.execute(sql_select([pmid]).where(matches).order_by(pmid).limit(1).offset(
+            part * total // parts
+        )).scalar() if total else None
+
+        if start is not None and start not in starts:
+            starts.append(start)
+
+    ends = [start - 1 for start in starts[1:]] + [last]
+    logger.debug("partitioned %i records into %i parts", total, len(starts))
+    return list(zip(starts, ends))
+
+
+def prefetch(session: Session, records, depth: int) -> iter:
+    """
+    Yield the records that the function *records* (e.g., a partial `select`)
+    returns for a new session on the *session*'s DB with its own connection,
+    fetching them in batches of `QUERY_LIMIT` records in a background thread
+    that works up to *depth* batches ahead (see `_Pipeline`), so the DB
+    fetches the next batch(es) while the current one is consumed.
+
+    As the new session is used by the background thread, the records must
+    have all relations the consumer accesses loaded (see `WRITE_RELATIONS`).
+    """
+    url = session.get_bind().url
+
+    if url.get_dialect().name == 'sqlite' and url.database in (None, '', ':memory:'):
+        # each thread has its own in-memory DB
+        logger.warning('cannot prefetch records from an in-memory SQLite DB')
+        yield from records(session)
+        return
+
+    background = NewSession(bind=session.get_bind())
+
+    for batch in _Pipeline(_batched(_closing(background, records), QUERY_LIMIT), depth):
+        yield from batch
+
+
+def _closing(session: Session, records) -> iter:
+    """Yield the *records* for a *session* and close it in the same thread."""
+    try:
+        yield from records(session)
+    finally:
+        session.close()
+
+
+def _batched(items: iter, size: int) -> iter([list]):
+    """Yield lists of *size* (or the remaining) *items*."""
+    items = iter(items)
+    batch = list(islice(items, size))
+
+    while batch:
+        yield batch
+        batch = list(islice(items, size))
+
+
+def _pages(session: Session, query) -> iter([Citation]):
+    """
+    Yield the records of a *query* in pages of `QUERY_LIMIT` records
+    using keyset pagination on the PMID (``WHERE pmid > :last``).
+
+    After each page, its records are expunged from the *session* and the
+    transaction ends, so neither the identity map nor the transaction
+    grow with the number of records.
+    """
+    last = 0
+
+    while True:
+        page = query.filter(Citation.pmid > last).order_by(Citation.pmid).limit(
+            QUERY_LIMIT
+        ).all()
+
+        if not page:
+            break
+
+        for record in page:
+            yield record
+
+        last = page[-1].pmid
+
+        for record in page:
+            session.expunge(record)
+
+        session.commit()
+
+
+def _snapshot(session: Session, query) -> iter([Citation]):
+    """
+    Yield the records of a *query*, ordered by PMID, from a server-side
+    cursor (``stream_results``) in a ``REPEATABLE READ`` transaction,
+    expunging the records after every `QUERY_LIMIT` records.
+    """
+    session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+    batch = []
+
+    try:
+        for record in query.order_by(Citation.pmid).yield_per(QUERY_LIMIT):
+            yield record
+            batch.append(record)
+
+            if len(batch) == QUERY_LIMIT:
+                for done in batch:
+                    session.expunge(done)
+
+                batch = []
+    finally:
+        session.rollback()
+
+
+def _eagerLoad(relation: str):
+    """Return the `selectinload` option for a (dotted) *relation* path."""
+    names = relation.split('.')
+    option = selectinload(names[0])
+
+    for name in names[1:]:
+        option = option.selectinload(name)
+
+    return option
+
+
+def tabulate(session: Session, pmids: list([int]), file, where: list=()) -> int:
+    """
+    Write one TSV line with the PMID, title, and abstract per record for a
+    list of *PMIDs* (or all records, ordered by PMID, if the list is empty)
+    that match all *where* predicates (see `filters`) to a text *file*
+    handle and return the number of lines written.
+
+    Unlike writing the `Citation` records from `select`, the lines are
+    assembled by the DB (see `_textQuery`); with PostgreSQL, they are
+    streamed with ``COPY ... TO STDOUT``.
+    """
+    conn = session.connection()
+    count = 0
+
+    for query in _textQueries(conn, 'tsv', pmids, where):
+        if conn.dialect.name == 'postgresql':
+            count += _copyText(conn, query, file)
+        else:
+            for pmid, title, abstract in conn.execute(query):
+                file.write('{}\t{}\t{}\n'.format(pmid, title, abstract))
+                count += 1
+
+    logger.info("tabulated %i records", count)
+    return count
+
+
+def tiab(session: Session, pmids: list([int]), where: list=()) -> iter([(int, str)]):
+    """
+    Yield the PMID and TIAB text (the title followed by the labeled
+    sections of the abstract) of each record for a list of *PMIDs* (or all
+    records, ordered by PMID, if the list is empty) that matches all
+    *where* predicates (see `filters`), assembled by the DB (see `_textQuery`).
+    """
+    conn = session.connection()
+    count = 0
+
+    for query in _textQueries(conn, 'tiab', pmids, where):
+        for pmid, text in conn.execution_options(stream_results=True).execute(query):
+            count += 1
+            yield pmid, text
+
+    logger.info("retrieved %i TIAB texts", count)
+
+
+def _textQueries(conn, output_format: str, pmids: list([int]), where: list=()) -> iter:
+    """
+    Yield the `_textQuery` for each chunk of *pmids* that fits next to the
+    other parameters of the query (see `medic.orm.InLimit`), or for all
+    citations.
+    """
+    if pmids:
+        # the parameters of a query for a single PMID, minus that PMID
+        limit = InLimit([_textQuery(conn.dialect.name, output_format, pmids[:1], where)]) + 1
+
+        for offset in range(0, len(pmids), limit):
+            yield _textQuery(conn.dialect.name, output_format,
+                             pmids[offset:offset + limit], where)
+    else:
+        yield _textQuery(conn.dialect.name, output_format, where=where)
+
+
+def _textQuery(dialect: str, output_format: str, pmids: list([int])=None, where: list=()):
+    """
+    Return a query of the PMID and text of each citation (for a list of
+    *pmids* only, if given, and matching all *where* predicates), ordered
+    by PMID, in the *output_format*:
+
+    - ``tsv``: the pruned title and abstract (two columns), where pruning
+      replaces tabs and newlines with spaces, and the pruned sections of the
+      abstract are joined by spaces;
+    - ``tiab``: the title and a newline, followed by each section as an empty
+      line, its label line (if any), and its content line.
+
+    Just as the writers of ``medic write``, the abstract used is NLM's, or
+    the only abstract a citation has (see `_abstractSources`).
+    """
+    c = Citation.__table__.c
+    s = Section.__table__.c
+
+    if output_format == 'tsv':
+        piece, separator = _prune(s.content), ' '
+    else:
+        piece = literal('\n') + func.coalesce(s.label + '\n', '') + s.content + '\n'
+        separator = ''
+
+    selection = _selection(pmids, where)
+    sources = _abstractSources(selection).alias('sources')
+    sections = _restrict(
+        sql_select([s.pmid, s.seq, piece.label('piece')]).select_from(
+            Section.__table__.join(sources, and_(s.pmid == sources.c.pmid,
+                                                 s.source == sources.c.source))
+        ), s.pmid, selection
+    )
+
+    if dialect == 'postgresql':
+        sections = sections.alias('sections')
+        text = func.string_agg(sections.c.piece, aggregate_order_by(
+            literal(separator), sections.c.seq
+        ), type_=UnicodeText)
+    else:
+        # SQLite does not flatten an ordered subquery into an aggregate query
+        sections = sections.order_by(s.pmid, s.seq).alias('sections')
+        text = func.group_concat(sections.c.piece, separator, type_=UnicodeText)
+
+    texts = sql_select([sections.c.pmid, text.label('text')]).group_by(
+        sections.c.pmid
+    ).alias('texts')
+    text = func.coalesce(texts.c.text, '', type_=UnicodeText)
+
+    if output_format == 'tsv':
+        columns = [c.pmid, _prune(c.title), text]
+    else:
+        columns = [c.pmid, c.title + '\n' + text]
+
+    return _restrict(sql_select(columns).select_from(
+        Citation.__table__.outerjoin(texts, c.pmid == texts.c.pmid)
+    ), c.pmid, selection).order_by(c.pmid)
+
+
+def _selection(pmids: list([int])=None, where: list=()):
+    """
+    Return a CTE selecting the PMIDs of the citations in *pmids* (if any)
+    that match all *where* predicates, or ``None`` to select all citations;
+    as the text queries refer to the CTE, its parameters are only sent once.
+    """
+    if not pmids and not where:
+        return None
+
+    c = Citation.__table__.c
+    query = sql_select([c.pmid]).where(and_(*where))
+
+    if pmids:
+        query = query.where(c.pmid.in_(list(pmids)))
+
+    return query.cte('selection')
+
+
+def _abstractSources(selection=None):
+    """
+    Select the PMID and source of the abstract each citation's text uses:
+    the NLM abstract, or the citation's only abstract, if it has just one.
+    """
+    a = Abstract.__table__.c
+    only = sql_select([a.pmid, func.min(a.source).label('source')])
+    return union(
+        _restrict(sql_select([a.pmid, a.source]).where(a.source == 'NLM'), a.pmid, selection),
+        _restrict(only, a.pmid, selection).group_by(a.pmid).having(func.count() == 1)
+    )
+
+
+def _restrict(query, column, selection=None):
+    """Restrict a *query* to rows where the PMID *column* is in a *selection* (if any)."""
+    if selection is None:
+        return query
+
+    return query.where(column.in_(sql_select([selection.c.pmid])))
+
+
+def _prune(text):
+    """Replace newlines and tabs in a *text* column expression with spaces."""
+    return func.replace(func.replace(text, '\n', ' '), '\t', ' ', type_=UnicodeText)
+
+
+def _copyText(conn, query, file) -> int:
+    """
+    Stream the rows of a text *query* to a *file* with PostgreSQL's
+    ``COPY ... TO STDOUT`` and return the number of rows copied.
+    """
+    writer = _CopyWriter(file)
+    cursor = conn.connection.cursor()
+
+    try:
+        cursor.copy_expert(_copySql(cursor, query, conn.dialect), writer)
+    finally:
+        cursor.close()
+
+    assert not writer.buffer, 'incomplete COPY line: %r' % writer.buffer
+    return writer.count
+
+
+def _copySql(cursor, query, dialect) -> bytes:
+    """
+    Return the ``COPY ... TO STDOUT`` statement of a text *query*, with its
+    parameters bound by the DB-API *cursor* (``COPY`` takes no parameters,
+    and SQLAlchemy cannot render all of them, e.g., dates, as literals).
+    """
+    compiled = query.compile(dialect=dialect)
+    return b'COPY (' + cursor.mogrify(str(compiled), compiled.params) + \
+        b') TO STDOUT WITH (FORMAT csv, DELIMITER E\'\\t\', ' \
+        b'QUOTE E\'\\x01\', ESCAPE E\'\\x02\')'
+
+
+ESCAPED = re.compile('\x02(.)', re.DOTALL)
+"An escaped character in a quoted ``COPY`` CSV field (see `_CopyWriter`)."
+
+
+class _CopyWriter(TextIOBase):
+    """
+    A text stream that decodes the CSV lines that ``COPY ... TO STDOUT``
+    writes with the (otherwise unused) quote character ``\\x01`` and escape
+    character ``\\x02`` (see `_copyText`) and writes them to a *file*.
+
+    PostgreSQL quotes fields with quote characters or line breaks (i.e.,
+    carriage returns, as newlines are pruned) and empty strings, so the
+    decoded lines match those written by `tabulate` with other dialects.
+    """
+
+    def __init__(self, file):
+        super(_CopyWriter, self).__init__()
+        self.file = file
+        self.buffer = ''
+        self.count = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        lines = (self.buffer + data).split('\n')
+        self.buffer = lines.pop()
+
+        for line in lines:
+            self.file.write('\t'.join(map(_unquote, line.split('\t'))))
+            self.file.write('\n')
+            self.count += 1
+
+        return len(data)
+
+
+def _unquote(field: str) -> str:
+    """Decode a CSV *field* quoted with ``\\x01`` and escaped with ``\\x02``."""
+    if field.startswith('\x01'):
+        return ESCAPED.sub(r'\1', field[1:-1])
+    else:
+        return field
+
+
+def filters(years: tuple=None, journals: list=(), states: list=(), mesh: list=(),
+            pubtypes: list=(), modified_since: date=None) -> list:
+    """
+    Return a list of SQL predicates on the `Citation` table to select or
+    delete only the citations (see `select` and `delete`)
+
+    - published in a range of *years* (an inclusive ``(first, last)`` tuple),
+    - in any of the *journals* (i.e., their ISO abbreviations),
+    - with any of the *states* (see `Citation.STATES`),
+    - with any of the *mesh* descriptor names,
+    - with any of the *pubtypes* (publication types), or
+    - modified on or after a *modified_since* date.
+
+    Repeated values of a criterion match any of them, and a citation has to
+    match all given criteria; descriptors and publication types are matched
+    with semi-joins (``pmid IN (SELECT ...)``) in the DB.
+    """
+    c = Citation.__table__.c
+    where = []
+
+    if years:
+        where.append(c.year.between(*years))
+
+    if journals:
+        where.append(c.journal.in_(list(journals)))
+
+    if states:
+        where.append(c.status.in_(list(states)))
+
+    if mesh:
+        d = Descriptor.__table__.c
+        where.append(c.pmid.in_(sql_select([d.pmid]).where(d.name.in_(list(mesh)))))
+
+    if pubtypes:
+        pt = PublicationType.__table__.c
+        where.append(c.pmid.in_(sql_select([pt.pmid]).where(pt.value.in_(list(pubtypes)))))
+
+    if modified_since:
+        where.append(c.modified >= modified_since)
+
+    return where
+
+
+def delete(session: Session, pmids: list([int]), where: list=()) -> bool:
+    """
+    Delete all records for a list of *PMIDs* (or all, if the list is empty)
+    that match all *where* predicates (see `filters`).
+
+    Instead of relying on the per-row ``ON DELETE CASCADE`` of the citations,
+    the PMIDs are loaded into a temporary table and each table is emptied of
+    them in bulk, leaves first (see `_deletePmids`); deleting all records
+    (without any predicates) truncates (PostgreSQL) or drops and re-creates
+    (otherwise) the tables.
+    """
+    if isinstance(pmids, SEQUENCES) and (len(pmids) or where):
+        count = _deletePmids(session.connection(), pmids, where)
+    elif isinstance(pmids, SEQUENCES) and len(pmids) == 0:
+        count = _deleteAll(session.connection())
     else:
         logger.critical("pmids not an [empty] list of integers: %s", repr(pmids))
         return False
@@ -80,6 +637,145 @@ def delete(session: Session, pmids: list([int])) -> bool:
     return True
 
 
+def stats(session: Session, recount: bool=False) -> list:
+    """
+    Return the (non-zero) row counts of all tables and of the citations by
+    year and status as a list of ``(name, key, count)`` tuples
+    (see `Statistic`).
+
+    The counts are maintained by medic whenever records are inserted,
+    updated, or deleted; with *recount*, they are rebuilt from the tables,
+    e.g., after loading a ``parse`` dump or an upgrade of the DB.
+    """
+    conn = session.connection()
+
+    if recount:
+        _recount(conn)
+        session.commit()
+        conn = session.connection()
+
+    t = Statistic.__table__
+    counts = [tuple(row) for row in conn.execute(
+        sql_select([t.c.name, t.c.key, t.c.count]).where(t.c.count != 0).order_by(
+            t.c.name, t.c.key
+        )
+    )]
+
+    if not counts and conn.execute(sql_select([Citation.__table__.c.pmid]).limit(1)).first():
+        logger.warning('no statistics for the records in the DB; use --recount')
+
+    return counts
+
+
+def _recount(conn):
+    """Rebuild the `Statistic` table by counting all rows."""
+    tables = _tables() + [Fingerprint.__table__]
+    deltas = _countCitations(conn, Citation.__table__)
+
+    for table in tables:
+        count = conn.execute(sql_select([func.count()]).select_from(table)).scalar()
+        deltas[table.name, Statistic.TOTAL] = count
+        logger.info('counted %i rows in %s', count, table.name)
+
+    conn.execute(Statistic.__table__.delete())
+    Statistic.increment(conn, deltas)
+
+
+def apply(session: Session, files: iter, unique: bool) -> bool:
+    """
+    Atomically apply MEDLINE update *files*, one after the other, in order.
+
+    The parsed rows of each file are loaded into staging tables (``UNLOGGED``
+    tables and ``COPY`` on PostgreSQL, temporary tables otherwise).
+    Then, in a single transaction, all updated and ``DeleteCitation`` records
+    are deleted and the staged rows are inserted with set-based statements,
+    so readers never see missing records.
+
+    :param session: the SQL Alchemy DB session
+    :param files: the MEDLINE XML update files to apply (optionally, gzipped)
+    :param unique: if ``True``, only VersionID == "1" records are applied
+    """
+    conn = session.get_bind().connect()
+
+    try:
+        staging = _createStaging(conn)
+
+        for f in files:
+            data, deletion = _parseUpdate(f, unique)
+            _applyUpdate(conn, staging, data, deletion, basename(f))
+
+        return True
+    except DatabaseError:
+        logger.exception('applying updates failed')
+        return False
+    finally:
+        conn.close()
+
+
+def sync(session: Session, directory: str, unique: bool, parse_ahead: int=2) -> bool:
+    """
+    Apply all pending MEDLINE update files in a *directory*, in order.
+
+    Update files (``*.xml`` or ``*.xml.gz``) are pending if they are not
+    recorded in the DB (see `UpdateFile`); files are applied as with `apply`,
+    strictly in the order of their names, and recorded in the same
+    transaction, so re-running a sync never applies a file twice.
+    While a file is being applied, the next *parse_ahead* files are
+    parsed by background processes.
+
+    :param session: the SQL Alchemy DB session
+    :param directory: the path to the directory with the update files
+    :param unique: if ``True``, only VersionID == "1" records are applied
+    :param parse_ahead: the number of files to parse ahead (in parallel)
+    """
+    conn = session.get_bind().connect()
+
+    try:
+        applied = {row[0] for row in conn.execute(
+            sql_select([UpdateFile.__table__.c.name])
+        )}
+        pending = iter([
+            name for name in sorted(listdir(directory))
+            if _isUpdateFile(name) and name not in applied
+        ])
+        staging = _createStaging(conn)
+        parse_ahead = max(1, parse_ahead)
+        count = 0
+
+        with ProcessPoolExecutor(parse_ahead) as pool:
+            parsing = deque()
+            submit = lambda name: parsing.append((name, pool.submit(
+                _parseUpdate, join(directory, name), unique
+            )))
+
+            for name in islice(pending, parse_ahead):
+                submit(name)
+
+            while parsing:
+                name, future = parsing.popleft()
+
+                for name_ahead in islice(pending, 1):
+                    submit(name_ahead)
+
+                data, deletion = future.result()
+                _applyUpdate(conn, staging, data, deletion, name)
+                count += 1
+
+        logger.info('applied %i update files from %s', count, directory)
+        return True
+    except DatabaseError:
+        logger.exception('syncing updates failed')
+        return False
+    finally:
+        conn.close()
+
+
+def _isUpdateFile(name: str) -> bool:
+    """Return ``True`` if the file *name* looks like a MEDLINE XML file."""
+    name = name.lower()
+    return name.endswith('.xml') or name.endswith('.xml.gz')
+
+
 def dump(files: iter, output_dir: str, unique: bool, update_all: bool):
     """
     Parse MEDLINE XML files into tabular flat-files for each DB table.
@@ -159,11 +855,469 @@ def _dump(in_stream, out_stream: dict, parser: Parser, update_all: bool) -> int:
     return count
 
 
-def _add(session: Session, files_or_pmids: iter, dbHandle, unique: bool=True):
-    pmids = []
+class _Loader:
+    """
+    Send citations to the DB session, committing every *batch_size* citations.
+
+    After each commit, all instances are expunged from the session, so its
+    identity map and pending list never hold more than one batch.
+    A *batch_size* of zero (or ``None``) means only the final `commit`
+    will send the data to the DB.
+
+    If a *reject_file* is given, each batch is written in a savepoint; if the
+    batch fails, it is rolled back and its citations are retried one by one
+    (each in its own savepoint), writing the PMID and error of each failing
+    citation to the *reject_file* instead of aborting the load.
+    """
+
+    SAVEPOINTS = True
+    "Whether batches are written to the session inside savepoints."
+
+    def __init__(self, session: Session, handle, batch_size: int=0,
+                 reject_file: str=None):
+        """
+        :param session: the SQL Alchemy DB session
+        :param handle: a function that takes one instance and sends it to the DB
+        :param batch_size: the number of citations per commit
+        :param reject_file: the path of the file to write rejected PMIDs to
+        """
+        self.session = session
+        self.handle = handle
+        self.batch_size = batch_size or 0
+        self.pending = 0
+        self.batches = 0
+        self.count = 0
+        self.deltas = Counter()
+        self.reject_file = reject_file
+        self.rejects = None
+        self.rejected = 0
+        self.batch = []
+        self.savepoint = None
+        self.state = None
+
+    def add(self, instances: list) -> int:
+        """Send one citation (a list of instances) to the DB; return ``1``."""
+        if self.reject_file is not None:
+            if not self.batch:
+                self.state = self.snapshot()
+
+            if self.savepoint is None and self.SAVEPOINTS:
+                self.savepoint = self.session.begin_nested()
+
+            self.batch.append(list(instances))
+
+        try:
+            self.send(instances)
+        except DatabaseError as e:
+            self.recover(e)
+
+        self.pending += 1
+
+        if self.batch_size and self.pending >= self.batch_size:
+            self.commit()
+
+        return 1
+
+    def send(self, instances: list):
+        """Send the *instances* of one citation to the DB handle."""
+        for i in instances:
+            _countRow(self.deltas, i.__tablename__, i.__dict__)
+
+        _handleCitation(self.handle, instances)
+
+    def flush(self):
+        """Send any citations buffered by the loader to the DB."""
+        pass
+
+    def clear(self):
+        """Drop any citations buffered by the loader."""
+        pass
+
+    def snapshot(self) -> dict:
+        """Return a copy of the counters a failed batch or citation rolls back."""
+        return dict(deltas=Counter(self.deltas))
+
+    def restore(self, state: dict):
+        """Reset the counters to a `snapshot` *state*."""
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def recover(self, error: DatabaseError):
+        """
+        Roll back the current batch after an *error* and retry its citations
+        one by one, rejecting the failing ones (or re-raise the error if there
+        is no reject file); the counters are rolled back, too.
+        """
+        if self.reject_file is None:
+            raise error
+
+        logger.warning('batch %i failed; retrying its %i citations one by one: %s',
+                       self.batches + 1, len(self.batch), _errorMessage(error))
+
+        if self.savepoint is not None:
+            self.savepoint.rollback()
+            self.savepoint = None
+
+        self.clear()
+        self.restore(self.state)
+        batch, self.batch = self.batch, []
+
+        for instances in batch:
+            savepoint = self.session.begin_nested() if self.SAVEPOINTS else None
+            state = self.snapshot()
+
+            try:
+                self.send(list(instances))
+                self.flush()
+                self.session.flush()
+
+                if savepoint is not None:
+                    savepoint.commit()
+            except DatabaseError as e:
+                if savepoint is not None:
+                    savepoint.rollback()
+
+                self.clear()
+                self.restore(state)
+                self.reject(instances, e)
+
+    def reject(self, instances: list, error: DatabaseError):
+        """Write the PMID of a citation and its *error* to the reject file."""
+        if self.rejects is None:
+            self.rejects = open(self.reject_file, 'wt', encoding='utf-8')
+
+        pmid = instances[0].pmid
+        logger.error('rejected PMID %i: %s', pmid, _errorMessage(error))
+        print(pmid, _errorMessage(error), sep='\t', file=self.rejects)
+        self.rejected += 1
+
+    def close(self):
+        """Close the reject file (if any citations were rejected)."""
+        if self.rejects is not None:
+            self.rejects.close()
+            self.rejects = None
+            logger.warning('rejected %i citations (see %s)', self.rejected, self.reject_file)
+
+    def commit(self):
+        """Commit the pending citations and expunge them from the session."""
+        try:
+            self.flush()
+
+            if self.savepoint is not None:
+                self.session.flush()
+        except DatabaseError as e:
+            self.recover(e)
+
+        if self.savepoint is not None:
+            self.savepoint.commit()
+            self.savepoint = None
+
+        self.batch = []
+        Statistic.increment(self.session.connection(), self.deltas)
+        self.deltas = Counter()
+        self.session.commit()
+        self.session.expunge_all()
+
+        if self.pending:
+            self.batches += 1
+            self.count += self.pending
+            logger.info('committed batch %i with %i citations (total: %i)',
+                        self.batches, self.pending, self.count)
+            self.pending = 0
+
+
+class _CoreLoader(_Loader):
+    """
+    Accumulate citations as per-table row dicts and load each batch with
+    `Citation.insert`, bypassing the ORM's unit-of-work.
+
+    As `Citation.insert` runs each batch in its own transaction (together
+    with the batch's `Statistic` deltas), rejected citations (see `_Loader`)
+    need no savepoints.
+    """
+
+    SAVEPOINTS = False
+
+    def __init__(self, session: Session, batch_size: int=0, reject_file: str=None):
+        super(_CoreLoader, self).__init__(
+            session, self.append, batch_size or CORE_BATCH_SIZE, reject_file
+        )
+        self.data = defaultdict(list)
+
+    def append(self, instance):
+        """Add an ORM *instance* as a row to the current batch."""
+        self.data[instance.__tablename__].append(AsRow(instance))
+
+    def flush(self):
+        """Insert the current batch of rows and its statistics in one transaction."""
+        if self.data:
+            Citation.insert(self.data, self.deltas)
+            self.data = defaultdict(list)
+            self.deltas = Counter()
+
+    def clear(self):
+        self.data = defaultdict(list)
+
+
+class _UpdateLoader(_Loader):
+    """
+    Write only those citations (and rows) to the DB that have changed.
+
+    Citations are buffered and their existing `Citation.revised` dates and
+    fingerprints are looked up in bulk (`QUERY_LIMIT` citations at a time).
+    A citation is skipped if neither its revision date nor its fingerprint
+    differ from the stored ones; the fingerprint is only computed for that
+    comparison if the (cheaper) revision dates match.
+    A stored citation without a fingerprint is diffed, too, but only gets a
+    new `Citation.modified` date if any of its rows actually changed.
+    For the changed citations, only the rows that differ from the stored ones
+    are inserted, updated, or deleted (see `_diffCitations`); the number of
+    rows written to each table are tracked in `counts`.
+    """
+
+    def __init__(self, session: Session, batch_size: int=0, reject_file: str=None):
+        super(_UpdateLoader, self).__init__(session, None, batch_size, reject_file)
+        self.buffer = []
+        self.skipped = 0
+        self.counts = defaultdict(Counter)
+
+    def send(self, instances: list):
+        """Buffer the *instances* of one citation."""
+        self.buffer.append(instances)
+
+        if len(self.buffer) >= QUERY_LIMIT:
+            self.flush()
+
+    def flush(self):
+        """Write the changes of all changed citations in the buffer."""
+        if not self.buffer:
+            return
+
+        stored = _lookupFingerprints(
+            self.session, [instances[0].pmid for instances in self.buffer]
+        )
+        changed = []
+
+        for instances in self.buffer:
+            pmid = instances[0].pmid
+            citation = _citation(instances)
+            digest = None
+
+            if pmid in stored and citation is not None:
+                revised, stored_digest = stored[pmid]
+
+                if stored_digest is not None and revised == citation.revised:
+                    digest = Fingerprint.compute(instances)
+
+                    if digest == stored_digest:
+                        continue
+
+            digest = digest or Fingerprint.compute(instances)
+            changed.append(instances + [Fingerprint(pmid, digest)])
+
+        skipped = len(self.buffer) - len(changed)
+        logger.debug('skipped %i unchanged of %i citations', skipped, len(self.buffer))
+        _diffCitations(self.session.connection(), changed, self.counts, self.deltas)
+        self.skipped += skipped
+        self.buffer = []
+
+    def clear(self):
+        self.buffer = []
+
+    def snapshot(self) -> dict:
+        state = super(_UpdateLoader, self).snapshot()
+        state['skipped'] = self.skipped
+        state['counts'] = defaultdict(Counter, {
+            name: Counter(count) for name, count in self.counts.items()
+        })
+        return state
+
+    def commit(self):
+        super(_UpdateLoader, self).commit()
+
+        if self.skipped:
+            logger.info('skipped %i unchanged citations (total)', self.skipped)
+
+        for table in _tables() + [Fingerprint.__table__]:
+            if table.name in self.counts:
+                count = self.counts[table.name]
+                logger.info('%s: %i inserted, %i updated, %i deleted, '
+                            '%i unchanged rows (total)', table.name, count['inserted'],
+                            count['updated'], count['deleted'], count['unchanged'])
+
+
+def _diffCitations(conn, citations: list, counts: dict, deltas: Counter=None):
+    """
+    Write only the differences between the rows of the *citations* (lists of
+    instances) and their stored rows, table by table.
+
+    Rows are matched by their primary keys: New rows are inserted, rows with
+    different values are updated, and stored rows that are no longer present
+    are deleted (leaves first); unchanged rows are not touched.
+    A stored citation is only updated (and so gets a new `Citation.modified`
+    date) if any of its rows (other than its `Fingerprint`) changed.
+
+    :param conn: the DB connection to use
+    :param citations: the list of citations to write
+    :param counts: a mapping of table names to counters of ``inserted``,
+                   ``updated``, ``deleted``, and ``unchanged`` rows
+    :param deltas: a counter of the changes to the `Statistic` counts
+    """
+    if deltas is None:
+        deltas = Counter()
+
+    if not citations:
+        return
+
+    pmids = [instances[0].pmid for instances in citations]
+    new = defaultdict(OrderedDict)
+    changes = []
+    touched = set()  # PMIDs with changed rows
+
+    for instances in citations:
+        for i in instances:
+            row = AsRow(i)
+            new[i.__tablename__][_primaryKey(i.__table__, row)] = row
+
+    # diff the leaves first to know which citations were touched
+    for table in reversed(_tables() + [Fingerprint.__table__]):
+        rows = new[table.name]
+        stored = {}
+
+        for row in conn.execute(sql_select([table]).where(table.c.pmid.in_(pmids))):
+            row = dict(row)
+            stored[_primaryKey(table, row)] = row
+
+        inserts = [row for key, row in rows.items() if key not in stored]
+        deletes = [row for key, row in stored.items() if key not in rows]
+
+        if table is Citation.__table__:
+            updates = [row for key, row in rows.items() if key in stored and (
+                row['pmid'] in touched or
+                any(row[k] != stored[key][k] for k in row if k != 'modified')
+            )]
+        else:
+            updates = [row for key, row in rows.items() if key in stored and row != stored[key]]
+
+        if table is not Fingerprint.__table__:
+            touched.update(row['pmid'] for row in chain(inserts, updates, deletes))
+
+        changes.insert(0, (table, inserts, updates, deletes))
+        count = counts[table.name]
+        count['inserted'] += len(inserts)
+        count['updated'] += len(updates)
+        count['deleted'] += len(deletes)
+        count['unchanged'] += len(rows) - len(inserts) - len(updates)
+
+        for row in inserts:
+            _countRow(deltas, table.name, row)
+
+        for row in deletes:
+            _countRow(deltas, table.name, row, -1)
+
+        if table is Citation.__table__:
+            for row in updates:
+                _countRow(deltas, table.name, stored[_primaryKey(table, row)], -1)
+                _countRow(deltas, table.name, row)
+
+    for table, _, _, deletes in reversed(changes):
+        if deletes:
+            pk = table.primary_key.columns
+            conn.execute(table.delete().where(and_(
+                *[c == bindparam(c.key) for c in pk]
+            )), [{c.key: row[c.key] for c in pk} for row in deletes])
+
+    for table, inserts, updates, _ in changes:
+        if updates:
+            pk = table.primary_key.columns
+            conn.execute(table.update().where(and_(
+                *[c == bindparam('pk_' + c.key) for c in pk]
+            )), [_updateParams(pk, row) for row in updates])
+
+        if inserts:
+            conn.execute(table.insert(), inserts)
+
+
+def _errorMessage(error: DatabaseError) -> str:
+    """Return the first line of the DB's message for an *error*."""
+    message = str(getattr(error, 'orig', None) or error)
+    return message.strip().split('\n', 1)[0]
+
+
+def _countRow(deltas: Counter, name: str, row: dict, sign: int=1):
+    """Count one *row* of table *name* into the `Statistic` *deltas*."""
+    deltas[name, Statistic.TOTAL] += sign
+
+    if name == Citation.__tablename__:
+        deltas[name, Statistic.YEAR.format(row['year'])] += sign
+        deltas[name, Statistic.STATUS.format(row['status'])] += sign
+
+
+def _countCitations(conn, table: Table, where=None, sign: int=1) -> Counter:
+    """
+    Count the citations in *table* (optionally, only those matching a
+    *where* clause) by year and status as `Statistic` deltas.
+    """
+    deltas = Counter()
+    query = sql_select([table.c.year, table.c.status, func.count()])
+
+    if where is not None:
+        query = query.where(where)
+
+    for year, status, count in conn.execute(query.group_by(table.c.year, table.c.status)):
+        deltas[Citation.__tablename__, Statistic.YEAR.format(year)] += sign * count
+        deltas[Citation.__tablename__, Statistic.STATUS.format(status)] += sign * count
+
+    return deltas
+
+
+def _total(conn, name: str) -> int:
+    """Return the row count of table *name* from the `Statistic` table."""
+    t = Statistic.__table__
+    return conn.execute(sql_select([t.c.count]).where(
+        (t.c.name == name) & (t.c.key == Statistic.TOTAL)
+    )).scalar() or 0
+
+
+def _primaryKey(table: Table, row: dict) -> tuple:
+    """Return the primary key values of a *row* (a `dict`) of a *table*."""
+    return tuple(row[c.key] for c in table.primary_key.columns)
+
+
+def _updateParams(pk, row: dict) -> dict:
+    """Return the ``UPDATE`` parameters for a *row*: ``pk_`` + keys, values."""
+    params = {'pk_' + c.key: row[c.key] for c in pk}
+    params.update((k, v) for k, v in row.items() if k not in pk)
+    return params
+
+
+def _lookupFingerprints(session: Session, pmids: list) -> dict:
+    """
+    Return a mapping of the *pmids* that exist in the DB to a tuple of
+    their `Citation.revised` date and their `Fingerprint.digest`
+    (``None`` if the citation has no fingerprint yet).
+    """
+    query = session.query(
+        Citation.pmid, Citation.revised, Fingerprint.digest
+    ).outerjoin(
+        Fingerprint, Citation.pmid == Fingerprint.pmid
+    ).filter(Citation.pmid.in_(pmids))
+    return {pmid: (revised, digest) for pmid, revised, digest in query}
+
+
+def _citation(instances: list) -> Citation:
+    """Return the `Citation` among a citation's *instances* (or ``None``)."""
+    for i in instances:
+        if isinstance(i, Citation):
+            return i
+
+    return None
+
+
+def _add(session: Session, files_or_pmids: iter, loader: _Loader, unique: bool=True,
+         queue_size: int=0):
+    pmids = array(TYPECODE)
     count = 0
-    initial = session.query(Citation).count() if \
-        logger.isEnabledFor(logging.INFO) else 0
 
     try:
         for arg in files_or_pmids:
@@ -171,31 +1325,37 @@ def _add(session: Session, files_or_pmids: iter, dbHandle, unique: bool=True):
                 pmids.append(int(arg))
             except ValueError:
                 count += _streamInstances(
-                    session, dbHandle, _fromFile(arg, unique)
+                    session, loader, _fromFile(arg, unique), queue_size
                 )
 
         if len(pmids):
-            count += _downloadAll(session, dbHandle, pmids, unique)
+            count += _downloadAll(session, loader, pmids, unique, queue_size)
 
-        session.commit()
-
-        if logger.isEnabledFor(logging.INFO):
-            final = session.query(Citation).count()
-            logger.info('parsed %i entities (records before/after: %i/%i)',
-                        count, initial, final)
+        loader.commit()
+        logger.info('parsed %i entities (records: %s)', count,
+                    _total(session.connection(), Citation.__tablename__))
         return True
     except IntegrityError:
         logger.exception('DB integrity violated (duplicate records?)')
         session.rollback()
+
+        if loader.batches:
+            logger.error('rolled back the current batch only; %i citations '
+                         'in %i batches were committed',
+                         loader.count, loader.batches)
+
         return False
     except DatabaseError:
         logger.exception('adding records failed')
         if session.dirty:
             session.rollback()
         return False
+    finally:
+        loader.close()
 
 
-def _streamInstances(session: Session, handle, stream: iter) -> int:
+def _streamInstances(session: Session, loader: _Loader, stream: iter,
+                     queue_size: int=0) -> int:
     """
     Stream citations and delete records in DB.
 
@@ -203,24 +1363,291 @@ def _streamInstances(session: Session, handle, stream: iter) -> int:
     all citations have been handled.
 
     :param session: the DB session object (SQL Alchemy)
-    :param handle: a DB handle to send ORM instances
+    :param loader: a `_Loader` to send the citations to
+    :param stream: the parsed instances
+    :param queue_size: if not zero, parse the stream in a `_Pipeline`
     """
     count = 0
     deletion = []
+    citations = _collectCitation(stream)
+
+    if queue_size:
+        citations = _Pipeline(citations, queue_size)
 
-    for citation in _collectCitation(stream):
+    for citation in citations:
         if type(citation) == int:
             deletion.append(citation)
         else:
-            count += _handleCitation(handle, citation)
+            count += loader.add(citation)
 
     if deletion:
+        loader.commit()
         delete(session, deletion)
 
     logging.debug("streamed %i citations", count)
     return count
 
 
+class _Pipeline:
+    """
+    Iterate over the items of an iterable that is consumed in a background
+    thread, buffering up to *queue_size* items in a queue.
+
+    This lets the producer (the parser) and the consumer (the DB) work
+    concurrently, with backpressure from the bounded queue.
+    The time the producer waited for a full queue is tracked as
+    `producer_stall` and the time the consumer waited for an empty queue
+    as `consumer_stall` (both in seconds): If the producer stalls, the
+    consumer is the bottleneck, and vice versa.
+    The time the producer spent producing the items is tracked as `busy`;
+    the `overlap` is the fraction of that time hidden behind the consumer.
+    """
+
+    _END = object()
+
+    def __init__(self, items: iter, queue_size: int):
+        self.items = items
+        self.queue = Queue(queue_size)
+        self.stopped = Event()
+        self.producer_stall = 0.0
+        self.consumer_stall = 0.0
+        self.busy = 0.0
+        self.error = None
+
+    @property
+    def overlap(self) -> float:
+        """The fraction of the producer's `busy` time the consumer did not wait for."""
+        return max(0.0, 1.0 - self.consumer_stall / self.busy) if self.busy else 0.0
+
+    def __iter__(self) -> iter:
+        thread = Thread(target=self._produce, name='medic-pipeline', daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                start = time()
+                item = self.queue.get()
+                self.consumer_stall += time() - start
+
+                if item is _Pipeline._END:
+                    break
+
+                yield item
+        finally:
+            self.stopped.set()
+            thread.join()
+            logger.info('pipeline stalls: producer %.3fs (queue full), '
+                        'consumer %.3fs (queue empty); producer busy %.3fs '
+                        '(%.0f%% overlap)', self.producer_stall, self.consumer_stall,
+                        self.busy, 100 * self.overlap)
+
+        if self.error is not None:
+            raise self.error
+
+    def _produce(self):
+        start = time()
+
+        try:
+            for item in self.items:
+                self.busy += time() - start
+
+                if not self._put(item):
+                    return
+
+                start = time()
+        except Exception as e:
+            self.error = e
+        finally:
+            if hasattr(self.items, 'close'):
+                self.items.close()  # close generators in the producer thread
+
+            self._put(_Pipeline._END)
+
+    def _put(self, item) -> bool:
+        start = time()
+
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                self.producer_stall += time() - start
+                return True
+            except Full:
+                pass
+
+        return False
+
+
+def fanout(items: iter, consumers: list, depth: int=2) -> int:
+    """
+    Feed all *items* to each of the *consumers* (functions that iterate over
+    the items they are called with), each running in its own thread, so the
+    *items* (e.g., the records of one DB scan) are produced only once.
+
+    The items are sent in batches of `QUERY_LIMIT`, queueing up to *depth*
+    batches per consumer; if a consumer fails, no more items are produced,
+    the other consumers are ended, and the first error is re-raised.
+
+    :return: the number of items produced
+    """
+    queues = [Queue(depth) for _ in consumers]
+    errors = [None] * len(consumers)
+    threads = [
+        Thread(target=_consume, args=(consumer, queue, errors, i),
+               name='medic-fanout-{}'.format(i), daemon=True)
+        for i, (consumer, queue) in enumerate(zip(consumers, queues))
+    ]
+    count = 0
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        for batch in _batched(items, QUERY_LIMIT):
+            if any(error is not None for error in errors):
+                break
+
+            for queue in queues:
+                queue.put(batch)
+
+            count += len(batch)
+    finally:
+        if hasattr(items, 'close'):
+            items.close()
+
+        for queue in queues:
+            queue.put(None)
+
+        for thread in threads:
+            thread.join()
+
+    for error in errors:
+        if error is not None:
+            raise error
+
+    logger.info("fanned out %i items to %i consumers", count, len(consumers))
+    return count
+
+
+def _consume(consumer, queue: Queue, errors: list, index: int):
+    """Call a *consumer* on the batched items of a *queue* (see `fanout`)."""
+    def items():
+        batch = queue.get()
+
+        while batch is not None:
+            yield from batch
+            batch = queue.get()
+
+    stream = items()
+
+    try:
+        consumer(stream)
+    except Exception as e:
+        errors[index] = e
+    finally:
+        for _ in stream:
+            pass  # drain the queue, so the producer never blocks
+
+
+class BackgroundWriter(TextIOBase):
+    """
+    A text stream that collects writes into chunks of about *chunk_size*
+    characters and writes them to a *file* in a background thread, queueing
+    up to *depth* chunks, so rendering and writing the output overlap.
+
+    The time the renderer waited for a full queue is tracked as
+    `render_stall`, and the time the writer waited for an empty queue as
+    `write_stall` (both in seconds); closing the stream writes all
+    remaining chunks, but does not close the *file*.
+
+    A `mark` queues a callback that the writer calls once all preceding
+    chunks are written and the *file* is flushed (e.g., to checkpoint the
+    output offset).
+    """
+
+    def __init__(self, file, depth: int=2, chunk_size: int=2 ** 16):
+        super(BackgroundWriter, self).__init__()
+        self.file = file
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.size = 0
+        self.queue = Queue(depth)
+        self.render_stall = 0.0
+        self.write_stall = 0.0
+        self.error = None
+        self.thread = Thread(target=self._write, name='medic-writer', daemon=True)
+        self.thread.start()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        if self.error is not None:
+            raise self.error
+
+        self.chunk.append(data)
+        self.size += len(data)
+
+        if self.size >= self.chunk_size:
+            self.flush()
+
+        return len(data)
+
+    def flush(self):
+        if self.chunk:
+            self._put(''.join(self.chunk))
+            self.chunk = []
+            self.size = 0
+
+    def mark(self, callback):
+        """Call *callback* (in the writer thread) after all writes so far are flushed."""
+        if self.error is not None:
+            raise self.error
+
+        self.flush()
+        self._put(callback)
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self._put(None)
+            self.thread.join()
+            super(BackgroundWriter, self).close()
+            logger.info('writer stalls: renderer %.3fs (queue full), '
+                        'writer %.3fs (queue empty)', self.render_stall, self.write_stall)
+
+            if self.error is not None:
+                raise self.error
+
+    def _put(self, chunk):
+        start = time()
+        self.queue.put(chunk)
+        self.render_stall += time() - start
+
+    def _write(self):
+        while True:
+            start = time()
+            chunk = self.queue.get()
+            self.write_stall += time() - start
+
+            if chunk is None:
+                break
+            elif self.error is None:
+                try:
+                    if callable(chunk):
+                        self.file.flush()
+                        chunk()
+                    else:
+                        self.file.write(chunk)
+                except Exception as e:
+                    self.error = e
+
+        if self.error is None:
+            try:
+                self.file.flush()
+            except Exception as e:
+                self.error = e
+
+
 def _collectCitation(stream: iter) -> iter:
     """Collect PMIDs or whole citation lists from the stream."""
     pub_types = []  # ouch - there are non-unique PublicationType entries in PubMed...
@@ -269,24 +1696,417 @@ def _handleCitation(handle, instances: list):
     return 1
 
 
-def _downloadAll(session: Session, dbHandle,
-                 pmids: list, unique: bool=True) -> int:
+def _downloadAll(session: Session, loader: _Loader,
+                 pmids: list, unique: bool=True, queue_size: int=0) -> int:
     """
     Download PubMed XML for a list of PMIDs (integers), parse the streams,
-    and send the ORM instances to a DB handle.
+    and send the ORM instances to a DB loader.
 
     :param session: the SQL Alchemy DB session
-    :param dbHandle: a function that takes one instance and sends it to the DB
+    :param loader: a `_Loader` to send the citations to
     :param pmids: the list of PMIDs to download
     :param unique: if ``True``, only VersionID == "1" records are handled.
+    :param queue_size: if not zero, download and parse in a `_Pipeline`
     """
+    return _streamInstances(session, loader, _download(pmids, unique), queue_size)
+
+
+def _download(pmids: list, unique: bool=True) -> iter:
+    """Download and parse PubMed XML for a list of PMIDs, 100 at a time."""
     parser = PubMedXMLParser(unique)
-    pmid_sets = [pmids[100 * i:100 * i + 100]
-                 for i in range(len(pmids) // 100 + 1)]
-    downloads = map(Download, pmid_sets)
-    instances = map(parser.parse, downloads)
-    streaming = partial(_streamInstances, session, dbHandle)
-    return sum(map(streaming, chain(instances)))
+    downloads = map(Download, _batched(pmids, 100))
+    return chain.from_iterable(map(parser.parse, downloads))
+
+
+def _parseEach(files_or_pmids: iter, unique: bool=True) -> iter:
+    """
+    Yield the parsed stream of each of the *files* and then a single stream
+    downloading all *PMIDs*.
+    """
+    pmids = array(TYPECODE)
+
+    for arg in files_or_pmids:
+        try:
+            pmids.append(int(arg))
+        except ValueError:
+            yield _fromFile(arg, unique)
+
+    if pmids:
+        yield _download(pmids, unique)
+
+
+def _updatePartitions(url, files_or_pmids: iter, unique: bool, batch_size: int,
+                      workers: int, partitions: list=None) -> bool:
+    """
+    Update the citations in parallel, partitioned by PMID across *workers*.
+
+    The files are parsed (or the PMIDs downloaded) in this process and each
+    citation (or deletion) is routed to the worker process for its partition
+    (``pmid % workers``); each worker has its own DB engine and commits its
+    partition independently, file by file (see `_updateWorker`).
+    Because no two partitions ever touch the same PMIDs, the workers never
+    contend for the same rows.
+    Once all workers are done, the result of each partition is reported;
+    a failed partition can be retried on its own by passing it as
+    *partitions* (while using the same number of *workers*).
+
+    :param url: the DB URL for the workers' engines
+    :param files_or_pmids: the files and/or PMIDs to update
+    :param unique: if ``True``, only VersionID == "1" records are handled
+    :param batch_size: the number of citations per commit in each worker
+    :param workers: the number of partitions
+    :param partitions: the partitions to update (default: all)
+    :return: ``True`` if all partitions were updated
+    """
+    partitions = sorted(set(partitions)) if partitions else list(range(workers))
+
+    if any(p < 0 or p >= workers for p in partitions):
+        logger.critical('partitions %s not in range [0, %i)', partitions, workers)
+        return False
+
+    results = ProcessQueue()
+    queues = {p: ProcessQueue(WORKER_QUEUE_SIZE) for p in partitions}
+    processes = {p: Process(
+        target=_updateWorker, args=(url, p, queues[p], results, batch_size),
+        name='medic-update-{}'.format(p)
+    ) for p in partitions}
+    routed = Counter()
+
+    for process in processes.values():
+        process.start()
+
+    try:
+        for stream in _parseEach(files_or_pmids, unique):
+            for citation in _collectCitation(stream):
+                pmid = citation if type(citation) == int else citation[0].pmid
+                p = pmid % workers
+
+                if p in processes and _route(queues[p], processes[p], citation):
+                    routed[p] += 1
+
+            for p in partitions:
+                _route(queues[p], processes[p], END_OF_FILE)
+    finally:
+        for p in partitions:
+            _route(queues[p], processes[p], None)
+
+        reports = {}
+
+        while len(reports) < len(partitions):
+            # a worker only exits after reporting, so once none is alive
+            # before waiting, a missing report means the worker died
+            alive = any(process.is_alive() for process in processes.values())
+
+            try:
+                partition, *report = results.get(timeout=1)
+                reports[partition] = report
+            except Empty:
+                if not alive:
+                    break
+
+        for p, process in processes.items():
+            process.join()
+            queues[p].cancel_join_thread()  # drop citations of failed workers
+
+    failed = []
+
+    for p in partitions:
+        if p in reports and reports[p][0]:
+            _, count, skipped, _ = reports[p]
+            logger.info('partition %i/%i: %i citations routed, %i committed '
+                        '(%i unchanged)', p, workers, routed[p], count, skipped)
+        else:
+            error = reports[p][3] if p in reports else 'worker died'
+            count = reports[p][1] if p in reports else 0
+            logger.error('partition %i/%i failed after committing %i of %i '
+                         'citations: %s', p, workers, count, routed[p], error)
+            failed.append(p)
+
+    if failed:
+        logger.error('retry the failed partitions with --workers %i %s', workers,
+                     ' '.join('--partition {}'.format(p) for p in failed))
+
+    return not failed
+
+
+def _route(queue, process: Process, item) -> bool:
+    """Put the *item* on a worker's *queue* unless the worker *process* died."""
+    while process.is_alive():
+        try:
+            queue.put(item, timeout=1)
+            return True
+        except Full:
+            pass
+
+    return False
+
+
+def _updateWorker(url, partition: int, queue, results, batch_size: int):
+    """
+    Update the citations of one *partition* received on the *queue* with an
+    `_UpdateLoader` on a new DB engine and report the outcome to *results*
+    as a ``(partition, success, written, skipped, error)`` tuple.
+
+    At the `END_OF_FILE` of each file (and at the end of the *queue*), the
+    citations are committed before the file's deletions are applied, so
+    that a later file can add a deleted citation again.
+    """
+    loader = None
+
+    try:
+        InitDb(url)
+        session = NewSession()
+        loader = _UpdateLoader(session, batch_size)
+        deletion = []
+
+        for citation in chain(iter(queue.get, None), [END_OF_FILE]):
+            if type(citation) == int:
+                deletion.append(citation)
+            elif citation == END_OF_FILE:
+                loader.commit()
+
+                if deletion and not delete(session, deletion):
+                    raise RuntimeError('deleting {} citations failed'.format(len(deletion)))
+
+                deletion = []
+            else:
+                loader.add(citation)
+
+        results.put((partition, True, loader.count, loader.skipped, None))
+    except Exception as e:
+        logger.exception('update partition %i failed', partition)
+        count, skipped = (loader.count, loader.skipped) if loader else (0, 0)
+        results.put((partition, False, count, skipped, str(e)))
+
+
+STAGING_PREFIX = 'medic_staging_'
+"Table name prefix of the staging tables used by `apply`."
+
+
+def _createStaging(conn) -> dict:
+    """
+    Create (if necessary) the staging tables on a DB connection.
+
+    The staging tables mirror the columns (but not the constraints) of the
+    `Citation` table and all its children; in addition, a ``delete`` table
+    holds the PMIDs to remove.
+
+    :return: a `dict` of table names to their staging `Table`
+    """
+    metadata = MetaData()
+    prefixes = ['UNLOGGED'] if conn.dialect.name == 'postgresql' else ['TEMPORARY']
+    staging = {}
+
+    for table in _tables():
+        staging[table.name] = Table(
+            STAGING_PREFIX + table.name, metadata,
+            *[Column(c.name, c.type.copy()) for c in table.c],
+            prefixes=prefixes
+        )
+
+    staging['delete'] = Table(
+        STAGING_PREFIX + 'delete', metadata, Column('pmid', BigInteger),
+        prefixes=prefixes
+    )
+    metadata.create_all(conn)
+    return staging
+
+
+def _deletePmids(conn, pmids: iter, where: list=()) -> int:
+    """
+    Delete the citations of all *PMIDs* via a temporary PMID table, staged
+    in batches of `CORE_BATCH_SIZE` PMIDs; return the number of deleted
+    citations.
+
+    With *where* predicates, only the matching citations (of all, if there
+    are no *PMIDs*) are deleted; as they might refer to any table, the
+    matching PMIDs are staged before deleting anything.
+    """
+    pmid_table = Table(
+        STAGING_PREFIX + 'delete_pmids', MetaData(),
+        Column('pmid', BigInteger, primary_key=True), prefixes=['TEMPORARY']
+    )
+    pmid_table.create(conn, checkfirst=True)
+    conn.execute(pmid_table.delete())
+    matches = sql_select([Citation.__table__.c.pmid]).where(and_(*where))
+
+    if len(pmids):
+        for batch in _batched(Sorted(pmids), CORE_BATCH_SIZE):
+            _stage(conn, pmid_table, [{'pmid': pmid} for pmid in batch])
+
+        if where:
+            conn.execute(pmid_table.delete().where(~pmid_table.c.pmid.in_(matches)))
+    else:
+        conn.execute(pmid_table.insert().from_select(['pmid'], matches))
+
+    count = _deleteWhere(conn, sql_select([pmid_table.c.pmid]))
+    conn.execute(pmid_table.delete())
+    return count
+
+
+def _deleteWhere(conn, pmids) -> int:
+    """
+    Delete the rows of all citations with the PMIDs in a *pmids* sub-query
+    from all tables, leaves first (i.e., semi-joining each table with the
+    sub-query once); return the number of deleted citations.
+    """
+    result = None
+    citations = Citation.__table__
+    deltas = _countCitations(conn, citations, citations.c.pmid.in_(pmids), -1)
+
+    for table in reversed(_tables() + [Fingerprint.__table__]):
+        result = conn.execute(table.delete().where(table.c.pmid.in_(pmids)))
+        deltas[table.name, Statistic.TOTAL] -= result.rowcount
+        logger.debug('deleted %i rows from %s', result.rowcount, table.name)
+
+    Statistic.increment(conn, deltas)
+    return result.rowcount
+
+
+def _deleteAll(conn) -> int:
+    """
+    Delete all citations with ``TRUNCATE ... CASCADE`` on PostgreSQL and by
+    dropping and re-creating the tables otherwise; return the number of
+    deleted citations.
+    """
+    tables = _tables() + [Fingerprint.__table__]
+    count = _total(conn, Citation.__tablename__)
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute('TRUNCATE {} CASCADE'.format(', '.join(t.name for t in tables)))
+    else:
+        metadata = Citation.metadata
+        metadata.drop_all(conn, tables=tables)
+        metadata.create_all(conn, tables=tables)
+
+    stats = Statistic.__table__
+    conn.execute(stats.delete().where(stats.c.name.in_([t.name for t in tables])))
+    return count
+
+
+def _tables() -> list:
+    """Return the `Citation` table and all its children in insert order."""
+    return [Citation.__table__] + [cls.__table__ for cls in Citation.CHILDREN]
+
+
+def _parseUpdate(name: str, unique: bool) -> (dict, set):
+    """
+    Parse a MEDLINE update file into per-table row dicts and PMIDs to delete.
+
+    If a PMID is present multiple times, only its last citation is used;
+    citations that are deleted in the same file are dropped.
+    """
+    citations = OrderedDict()
+    deletion = set()
+
+    for citation in _collectCitation(_fromFile(name, unique)):
+        if type(citation) == int:
+            deletion.add(citation)
+        else:
+            citations[citation[0].pmid] = citation
+
+    data = defaultdict(list)
+
+    for pmid, instances in citations.items():
+        if pmid not in deletion:
+            for i in instances:
+                data[i.__tablename__].append(AsRow(i))
+
+    logger.info('parsed %i citations and %i deletions from %s',
+                len(data[Citation.__tablename__]), len(deletion), name)
+    return data, deletion
+
+
+def _applyUpdate(conn, staging: dict, data: dict, deletion: set, name: str=None):
+    """
+    Stage the rows in *data* and the PMIDs in *deletion*, then merge them.
+
+    If a file *name* is given, the file is recorded as an `UpdateFile`
+    in the same transaction as the merge.
+    """
+    with conn.begin():
+        for table in staging.values():
+            if conn.dialect.name == 'postgresql':
+                conn.execute('TRUNCATE {}'.format(table.name))
+            else:
+                conn.execute(table.delete())
+
+        for tablename, rows in data.items():
+            _stage(conn, staging[tablename], rows)
+
+        _stage(conn, staging['delete'], [{'pmid': pmid} for pmid in deletion])
+
+    citations = Citation.__table__
+    deletes = staging['delete']
+
+    with conn.begin():
+        conn.execute(deletes.insert().from_select(
+            ['pmid'], sql_select([staging[citations.name].c.pmid])
+        ))
+        count = _deleteWhere(conn, sql_select([deletes.c.pmid]))
+        logger.info('deleted %i citations', count)
+
+        deltas = _countCitations(conn, staging[citations.name])
+
+        for table in _tables():
+            columns = [c.name for c in table.c]
+            result = conn.execute(table.insert().from_select(
+                columns, sql_select([staging[table.name].c[c] for c in columns])
+            ))
+            deltas[table.name, Statistic.TOTAL] += result.rowcount
+            logger.debug('inserted %i rows into %s', result.rowcount, table.name)
+
+        Statistic.increment(conn, deltas)
+
+        if name is not None:
+            files = UpdateFile.__table__
+            conn.execute(files.delete().where(files.c.name == name))
+            conn.execute(files.insert(), AsRow(UpdateFile(
+                name, datetime.now(), len(data[citations.name]), len(deletion)
+            )))
+
+    logger.info('applied %i citations from %s', len(data[citations.name]), name)
+
+
+def _stage(conn, table: Table, rows: list):
+    """Load *rows* into a staging *table* (using ``COPY`` with PostgreSQL)."""
+    if not rows:
+        return
+
+    if conn.dialect.name == 'postgresql':
+        columns = [c.name for c in table.c]
+        buffer = StringIO()
+
+        for row in rows:
+            buffer.write('\t'.join(_copyValue(row[c]) for c in columns))
+            buffer.write('\n')
+
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+
+        try:
+            cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(
+                table.name, ', '.join(columns)
+            ), buffer)
+        finally:
+            cursor.close()
+    else:
+        conn.execute(table.insert(), rows)
+
+
+def _copyValue(value) -> str:
+    """Format a Python *value* for the PostgreSQL ``COPY`` text format."""
+    if value is None:
+        return '\\N'
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, date):
+        return value.isoformat()
+    elif isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t')\
+            .replace('\n', '\\n').replace('\r', '\\r')
+    else:
+        return str(value)
 
 
 def _fromFile(name: str, unique: bool) -> iter:
@@ -0,0 +1,94 @@
+"""
+.. py:module:: medic.jsonl
+   :synopsis: Format records as JSON objects (for JSON Lines output).
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+"""
+import logging
+
+from datetime import date
+
+from sqlalchemy import inspect
+
+from medic.orm import Citation, Abstract, Section, Author, Descriptor, Qualifier, \
+    Database, Chemical, Keyword
+
+try:
+    # use the (much) faster orjson encoder if it is available
+    # noinspection PyUnresolvedReferences
+    from orjson import dumps as _dumps
+
+    def Dumps(obj) -> str:
+        """Encode an object as compact JSON."""
+        return _dumps(obj).decode('utf-8')
+except ImportError:
+    from json import dumps as _dumps
+
+    def Dumps(obj) -> str:
+        """Encode an object as compact JSON."""
+        return _dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+logger = logging.getLogger(__name__)
+
+
+def _keys(entity, *excluded) -> tuple:
+    """Return the mapped column attribute names of an ORM *entity* less the *excluded*."""
+    return tuple(prop.key for prop in inspect(entity).column_attrs if prop.key not in excluded)
+
+
+CITATION = _keys(Citation)
+ABSTRACT = _keys(Abstract, 'pmid', 'source')
+SECTION = _keys(Section, 'pmid', 'source')
+AUTHOR = _keys(Author, 'pmid')
+DESCRIPTOR = _keys(Descriptor, 'pmid')
+QUALIFIER = _keys(Qualifier, 'pmid', 'num')
+CHEMICAL = _keys(Chemical, 'pmid')
+DATABASE = _keys(Database, 'pmid')
+KEYWORD = _keys(Keyword, 'pmid')
+
+
+def FormatJSON(record) -> str:
+    """Format a record as one line of JSON (without the newline; see `AsDict`)."""
+    logger.debug('writing PMID %i as JSON', record.pmid)
+    return Dumps(AsDict(record))
+
+
+def AsDict(record) -> dict:
+    """
+    Convert a record (a `Citation` or a `medic.reader.Record`) with all its
+    relations to a `dict` of JSON values: the citation's columns, the
+    ``abstracts`` by source (each with its ``sections``), the lists of
+    ``authors``, ``descriptors`` (each with its ``qualifiers``),
+    ``keywords``, ``chemicals``, ``databases``, and ``publication_types``,
+    and the ``identifiers`` by namespace; dates are ISO-formatted strings.
+    """
+    data = _values(record, CITATION)
+    data['abstracts'] = {
+        source: dict(_values(abstract, ABSTRACT), sections=[
+            _values(section, SECTION) for section in abstract.sections
+        ]) for source, abstract in record.abstracts.items()
+    }
+    data['authors'] = [_values(author, AUTHOR) for author in record.authors]
+    data['descriptors'] = [
+        dict(_values(desc, DESCRIPTOR), qualifiers=[
+            _values(qual, QUALIFIER) for qual in desc.qualifiers
+        ]) for desc in record.descriptors
+    ]
+    data['keywords'] = [_values(kwd, KEYWORD) for kwd in record.keywords]
+    data['chemicals'] = [_values(chem, CHEMICAL) for chem in record.chemicals]
+    data['databases'] = [_values(xref, DATABASE) for xref in record.databases]
+    data['identifiers'] = {ns: i.value for ns, i in record.identifiers.items()}
+    data['publication_types'] = [pt.value for pt in record.publication_types]
+    return data
+
+
+def _values(row, keys: tuple) -> dict:
+    """Return the values of the attributes *keys* of a *row* as a `dict`."""
+    values = {}
+
+    for key in keys:
+        value = getattr(row, key)
+        values[key] = value.isoformat() if isinstance(value, date) else value
+
+    return values
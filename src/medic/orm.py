@@ -7,8 +7,11 @@
 """
 
 import logging
-from datetime import date
-from sqlalchemy import engine, select, and_, Enum
+from datetime import date, datetime
+from hashlib import sha1
+from itertools import count
+from sqlalchemy import engine, select, and_, any_, bindparam, Enum
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from sqlalchemy import event
 # from sqlalchemy.engine import RowProxy
 from sqlalchemy.engine.url import URL
@@ -16,13 +19,14 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relation, session
 from sqlalchemy.orm.collections import column_mapped_collection
 from sqlalchemy.schema import \
-    Column, CheckConstraint, ForeignKeyConstraint, ForeignKey, Index
+    Column, CheckConstraint, ForeignKeyConstraint, ForeignKey, Index, MetaData, Table
 from sqlalchemy.types import \
-    Boolean, BigInteger, Date, SmallInteger, Unicode, UnicodeText
+    Boolean, BigInteger, Date, DateTime, Integer, SmallInteger, Unicode, UnicodeText
 
 __all__ = [
     'Citation', 'Abstract', 'Author', 'Chemical', 'Database', 'Descriptor',
-    'Identifier', 'Keyword', 'PublicationType', 'Qualifier', 'Section'
+    'Fingerprint', 'Identifier', 'Keyword', 'PublicationType', 'Qualifier', 'Section',
+    'Statistic', 'UpdateFile'
 ]
 
 _Base = declarative_base()
@@ -35,6 +39,14 @@ STRING = lambda s: s.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\
 
 logger = logging.getLogger(__name__)
 
+QUERY_LIMIT = 999
+"Maximum number of parameters that can be in an SQLite query; default is 999."
+
+TEMP_TABLE_THRESHOLD = 10000
+"Minimum number of keys to join against a temporary table (if not PostgreSQL)."
+
+_temp_tables = count()
+
 
 def InitDb(*args, **kwds):
     """
@@ -81,6 +93,26 @@ def Session(*args, **kwds):
     return _session(*args, **kwds)
 
 
+def AsRow(instance) -> dict:
+    """
+    Return the column values of an ORM *instance* as a `dict` for Core
+    inserts; unset (``None``) values of columns with a Python-side default
+    (e.g., `Citation.modified`) are replaced with that default.
+    """
+    row = {}
+
+    for column in instance.__table__.c:
+        value = getattr(instance, column.key)
+
+        if value is None and column.default is not None:
+            default = column.default
+            value = default.arg(None) if default.is_callable else default.arg
+
+        row[column.key] = value
+
+    return row
+
+
 def _fetch_first(query):
     """Given a *query*, fetch the first row and return the first element or ``None``."""
     conn = _db.engine.connect()
@@ -106,6 +138,70 @@ def _fetch_all(query):
         conn.close()
 
 
+def InLimit(where: iter=()) -> int:
+    """
+    Return the number of keys that fit into one ``IN (...)`` list next to
+    the bind parameters of the *where* clauses (see `QUERY_LIMIT`).
+    """
+    return max(1, QUERY_LIMIT - sum(len(clause.compile().params) for clause in where))
+
+
+def _fetch_in(columns, column, keys, *where):
+    """
+    Stream the rows of a select of *columns* (and the *where* clauses)
+    for all rows where *column* has one of the *keys*.
+
+    The strategy depends on the number of (unique) keys and the dialect:
+    Up to `InLimit` keys use a plain ``IN (...)`` list; on PostgreSQL, any
+    more keys are sent as a single array parameter (``= ANY(:keys)``);
+    otherwise, more than `TEMP_TABLE_THRESHOLD` keys are loaded into a
+    temporary table to join against, and any fewer are queried in chunks of
+    `InLimit` keys.
+    """
+    keys = list(dict.fromkeys(keys))
+    limit = InLimit(where)
+
+    if not keys:
+        return
+
+    conn = _db.engine.connect()
+    temp = None
+
+    try:
+        if len(keys) <= limit:
+            queries = [select(columns, and_(column.in_(keys), *where))]
+        elif conn.dialect.name == 'postgresql':
+            array = bindparam('keys', keys, type_=ARRAY(column.type))
+            queries = [select(columns, and_(column == any_(array), *where))]
+        elif len(keys) > TEMP_TABLE_THRESHOLD:
+            temp = Table(
+                'medic_keys_{}'.format(next(_temp_tables)), MetaData(),
+                Column('key', column.type.copy(), primary_key=True),
+                prefixes=['TEMPORARY']
+            )
+            temp.create(conn)
+            conn.execute(temp.insert(), [{'key': k} for k in keys])
+            queries = [select(columns, and_(*where)).select_from(
+                column.table.join(temp, column == temp.c.key)
+            )]
+        else:
+            queries = (
+                select(columns, and_(column.in_(keys[i:i + limit]), *where))
+                for i in range(0, len(keys), limit)
+            )
+
+        for query in queries:
+            logger.debug("%s", query)
+
+            for row in conn.execute(query):
+                yield row
+    finally:
+        if temp is not None:
+            temp.drop(conn)
+
+        conn.close()
+
+
 # noinspection PyUnresolvedReferences
 class SelectMixin(object):
     """
@@ -234,15 +330,8 @@ class Identifier(_Base, SelectMixin):
         If for a given DOI no mapping exists, it is no included in the
         returned dictionary.
         """
-        if not len(dois):
-            return {}
-
         c = cls.__table__.c
-        query = select(
-            [c.value, c.pmid], (c.namespace == 'doi') & c.value.in_(dois)
-        )
-        mappings = _fetch_all(query)
-        return dict(mappings) if mappings is not None else {}
+        return dict(_fetch_in([c.value, c.pmid], c.value, dois, c.namespace == 'doi'))
 
     @classmethod
     def mapPmids2Dois(cls, pmids: list):
@@ -253,15 +342,8 @@ class Identifier(_Base, SelectMixin):
         If for a given PMID no mapping exists, it is no included in the
         returned dictionary.
         """
-        if not len(pmids):
-            return {}
-
-        t = cls.__table__
-        query = select(
-            [t.c.pmid, t.c.value], (t.c.namespace == 'doi') & t.c.pmid.in_(pmids)
-        )
-        mappings = _fetch_all(query)
-        return dict(mappings) if mappings is not None else {}
+        c = cls.__table__.c
+        return dict(_fetch_in([c.pmid, c.value], c.pmid, pmids, c.namespace == 'doi'))
 
 
 # Index to make queries for a particular ID, e.g., a DOI, faster.
@@ -809,6 +891,187 @@ class Abstract(_Base, SelectMixin):
             self.copyright == other.copyright
 
 
+class Fingerprint(_Base):
+    """
+    A digest of a record's content to detect if an update changes it.
+
+    Attributes:
+
+        pmid
+            the record's identifier (PubMed ID)
+        digest
+            the SHA-1 hex digest of the record's rows (see `Fingerprint.compute`)
+
+    Primary Key: ``pmid``
+    """
+
+    __tablename__ = 'fingerprints'
+
+    pmid = Column(BigInteger, ForeignKey('citations.pmid', ondelete="CASCADE"), primary_key=True)
+    digest = Column(Unicode(length=40), CheckConstraint("digest <> ''"), nullable=False)
+
+    def __init__(self, pmid: int, digest: str):
+        assert pmid > 0, pmid
+        assert digest, repr(digest)
+        self.pmid = pmid
+        self.digest = digest
+
+    def __str__(self):
+        return '{}\t{}\n'.format(NULL(self.pmid), NULL(self.digest))
+
+    def __repr__(self):
+        return "Fingerprint<{}>".format(self.pmid)
+
+    def __eq__(self, other):
+        return isinstance(other, Fingerprint) and \
+            self.pmid == other.pmid and \
+            self.digest == other.digest
+
+    @classmethod
+    def compute(cls, instances: iter) -> str:
+        """
+        Return the digest of a record's *instances* (a `Citation` and its
+        children), independent of their order and of `Citation.modified`.
+        """
+        rows = sorted(
+            '{}:{}'.format(i.__tablename__, sorted(
+                (k, v) for k, v in AsRow(i).items() if k != 'modified'
+            )) for i in instances
+        )
+        return sha1('\n'.join(rows).encode('utf-8')).hexdigest()
+
+
+class UpdateFile(_Base):
+    """
+    A MEDLINE update file that has been applied to the DB.
+
+    Attributes:
+
+        name
+            the file's name (without its directory)
+        applied
+            the date and time the file was applied
+        citations
+            the number of citations in the file
+        deletions
+            the number of PMIDs deleted by the file (``DeleteCitation``)
+
+    Primary Key: ``name``
+    """
+
+    __tablename__ = 'update_files'
+
+    name = Column(Unicode(length=256), CheckConstraint("name <> ''"), primary_key=True)
+    applied = Column(DateTime, nullable=False)
+    citations = Column(Integer, CheckConstraint("citations >= 0"), nullable=False)
+    deletions = Column(Integer, CheckConstraint("deletions >= 0"), nullable=False)
+
+    def __init__(self, name: str, applied: datetime, citations: int=0, deletions: int=0):
+        assert name, repr(name)
+        assert isinstance(applied, datetime), repr(applied)
+        assert citations >= 0, citations
+        assert deletions >= 0, deletions
+        self.name = name
+        self.applied = applied
+        self.citations = citations
+        self.deletions = deletions
+
+    def __repr__(self):
+        return "UpdateFile<{}>".format(self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, UpdateFile) and \
+            self.name == other.name and \
+            self.applied == other.applied and \
+            self.citations == other.citations and \
+            self.deletions == other.deletions
+
+
+class Statistic(_Base):
+    """
+    The number of rows in a table, maintained incrementally by medic as
+    records are inserted, updated, and deleted.
+
+    Attributes:
+
+        name
+            the table's name
+        key
+            the empty string (`Statistic.TOTAL`) for the table's row count,
+            or (for citations only) a breakdown by ``year:<year>`` or
+            ``status:<status>``
+        count
+            the number of rows
+
+    Primary Key: ``(name, key)``
+    """
+
+    TOTAL = ''
+    YEAR = 'year:{}'
+    STATUS = 'status:{}'
+
+    __tablename__ = 'medic_stats'
+
+    name = Column(Unicode(length=64), CheckConstraint("name <> ''"), primary_key=True)
+    key = Column(Unicode(length=64), primary_key=True)
+    count = Column(BigInteger, nullable=False)
+
+    def __init__(self, name: str, key: str, count: int):
+        assert name, repr(name)
+        assert key is not None
+        self.name = name
+        self.key = key
+        self.count = count
+
+    def __repr__(self):
+        return "Statistic<{}:{}>".format(self.name, self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, Statistic) and \
+            self.name == other.name and \
+            self.key == other.key and \
+            self.count == other.count
+
+    @classmethod
+    def increment(cls, conn, deltas: dict):
+        """
+        Add the *deltas*, a mapping of ``(name, key)`` tuples to the change
+        of their counts, on the DB connection *conn*.
+
+        On PostgreSQL, this is a single ``INSERT ... ON CONFLICT DO UPDATE``
+        (so concurrent writers neither fail on new counts nor lose updates,
+        but they do serialize on the row locks of the counts they share,
+        e.g., the totals, until they commit); otherwise, each count is
+        updated or inserted (if it does not exist yet).
+        """
+        rows = [dict(name=name, key=key, count=delta)
+                for (name, key), delta in sorted(deltas.items()) if delta]
+
+        if not rows:
+            return
+
+        t = cls.__table__
+
+        if conn.dialect.name == 'postgresql':
+            query = pg_insert(t)
+            conn.execute(query.on_conflict_do_update(
+                index_elements=[t.c.name, t.c.key],
+                set_={'count': t.c.count + query.excluded.count}
+            ), rows)
+        else:
+            query = t.update().where(
+                (t.c.name == bindparam('name_')) & (t.c.key == bindparam('key_'))
+            ).values(count=t.c.count + bindparam('delta'))
+
+            for row in rows:
+                result = conn.execute(
+                    query, name_=row['name'], key_=row['key'], delta=row['count']
+                )
+
+                if result.rowcount == 0:
+                    conn.execute(t.insert(), row)
+
+
 class Citation(_Base):
     """
     A MEDLINE or PubMed citation record.
@@ -857,6 +1120,8 @@ class Citation(_Base):
             a :class:`list` of the record's chemicals
         databases
             a :class:`list` of the record's external DB references
+        fingerprint
+            the record's `Fingerprint` (if it has been updated before)
 
     Primary Key: ``pmid``
     """
@@ -864,7 +1129,8 @@ class Citation(_Base):
     STATES = frozenset({'Completed', 'In-Process', 'PubMed-not-MEDLINE',
                         'In-Data-Review', 'Publisher', 'MEDLINE', 'OLDMEDLINE'})
     CHILDREN = (
-        Section, Identifier, Database, Author, Descriptor, Qualifier,  # Qualifier last!
+        Abstract, Section, Identifier, Database, Author, Chemical, Keyword,
+        PublicationType, Descriptor, Qualifier,  # Qualifier last!
     )
     TABLENAMES = [cls.__tablename__ for cls in CHILDREN]
     TABLES = {cls.__tablename__: cls.__table__ for cls in CHILDREN}
@@ -879,21 +1145,33 @@ class Citation(_Base):
         Author, backref='citation', cascade='all, delete-orphan',
         order_by=Author.__table__.c.pos
     )
-    chemicals = relation(Chemical, backref='citation', cascade='all, delete-orphan')
-    databases = relation(Database, backref='citation', cascade='all, delete-orphan')
+    chemicals = relation(
+        Chemical, backref='citation', cascade='all, delete-orphan',
+        order_by=Chemical.__table__.c.idx
+    )
+    databases = relation(
+        Database, backref='citation', cascade='all, delete-orphan',
+        order_by=[Database.__table__.c.name, Database.__table__.c.accession]
+    )
     descriptors = relation(
         Descriptor, backref='citation', cascade='all, delete-orphan',
         order_by=Descriptor.__table__.c.num
     )
+    fingerprint = relation(
+        Fingerprint, backref='citation', cascade='all, delete-orphan', uselist=False
+    )
     identifiers = relation(
         Identifier, backref='citation', cascade='all, delete-orphan',
         collection_class=column_mapped_collection(Identifier.namespace)
     )
     keywords = relation(
         Keyword, backref='citation', cascade='all, delete-orphan',
-        order_by=Keyword.__table__.c.owner
+        order_by=[Keyword.__table__.c.owner, Keyword.__table__.c.cnt]
+    )
+    publication_types = relation(
+        PublicationType, backref='citation', cascade='all, delete-orphan',
+        order_by=PublicationType.__table__.c.value
     )
-    publication_types = relation(PublicationType, backref='citation', cascade='all, delete-orphan')
     qualifiers = relation(Qualifier, backref='citation')
     sections = relation(Section, backref='citation')
 
@@ -967,9 +1245,14 @@ class Citation(_Base):
         return "{}{}{}".format(self.pub_date, issue, pagination)
 
     @classmethod
-    def insert(cls, data: dict):
+    def insert(cls, data: dict, deltas: dict=None):
         """
         Insert *data* into all relevant tables.
+
+        The *data* is a `dict` mapping table names to lists of row dicts
+        (see `AsRow`) that are loaded with one ``executemany`` per table,
+        all in a single transaction, together with any `Statistic` *deltas*
+        (see `Statistic.increment`).
         """
         target_ins = dict(
             (tname, cls.TABLES[tname].insert())
@@ -1000,6 +1283,9 @@ class Citation(_Base):
                 elif tname in data and len(data[tname]):
                     conn.execute(target_ins[tname], data[tname])
 
+            if deltas:
+                Statistic.increment(conn, deltas)
+
             transaction.commit()
         except:
             transaction.rollback()
@@ -1014,15 +1300,11 @@ class Citation(_Base):
         for each row as a `sqlalchemy.engine.RowProxy`
         that matches one of the *pmids*.
         """
-        if not len(pmids):
-            return []
-
         c = cls.__table__.c
         mapping = {col.key: col for col in c}
         columns = [mapping[name] for name in attributes]
         columns.insert(0, c.pmid)
-        query = select(columns, c.pmid.in_(pmids))
-        return _fetch_all(query)
+        return list(_fetch_in(columns, c.pmid, pmids))
 
     @classmethod
     def selectAll(cls, pmids: list):
@@ -1031,12 +1313,7 @@ class Citation(_Base):
         for each row as a `sqlalchemy.engine.RowProxy`
         that matches one of the *pmids*.
         """
-        if not len(pmids):
-            return []
-
-        c = cls.__table__.c
-        query = select([cls.__table__], c.pmid.in_(pmids))
-        return _fetch_all(query)
+        return list(_fetch_in([cls.__table__], cls.__table__.c.pmid, pmids))
 
     @classmethod
     def delete(cls, primary_keys: list):
@@ -1064,17 +1341,8 @@ class Citation(_Base):
     @classmethod
     def existing(cls, pmids: list):
         """Return the sub- `set` of all *pmids* that exist in the DB."""
-        if not len(pmids):
-            return set()
-
         c = cls.__table__.c
-        query = select([c.pmid], c.pmid.in_(pmids))
-        conn = _db.engine.connect()
-
-        try:
-            return {row[0] for row in conn.execute(query)}
-        finally:
-            conn.close()
+        return {row[0] for row in _fetch_in([c.pmid], c.pmid, pmids)}
 
     @classmethod
     def missing(cls, pmids: list):
@@ -1087,16 +1355,5 @@ class Citation(_Base):
         Return the sub- `set` of all *pmids* that have been `modified`
         *before* a `datetime.date` in the DB.
         """
-        if not len(pmids):
-            return set()
-
         c = cls.__table__.c
-        query = select(
-            [c.pmid], c.pmid.in_(pmids) & (c.modified < before)
-        )
-        conn = _db.engine.connect()
-
-        try:
-            return set(row[0] for row in conn.execute(query))
-        finally:
-            conn.close()
+        return {row[0] for row in _fetch_in([c.pmid], c.pmid, pmids, c.modified < before)}
@@ -0,0 +1,186 @@
+"""
+.. py:module:: medic.pmids
+   :synopsis: Compact, sorted PMID lists (text, binary, or STDIN).
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+"""
+import logging
+import os
+import sys
+
+from array import array
+from heapq import merge
+from mmap import mmap, ACCESS_READ
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MEDICPM\x01'
+"The header of a binary PMID list, followed by the sorted PMIDs as little-endian int64s."
+
+TYPECODE = 'q'
+"The `array` type code of PMID arrays (signed 64-bit integers)."
+
+SORT_SIZE = 2 ** 20
+"Number of PMIDs sorted at a time before merging the sorted runs."
+
+SEQUENCES = (list, tuple, array, memoryview)
+"The types of PMID sequences the CRUD functions accept."
+
+
+def PmidArray(pmids: iter) -> array:
+    """
+    Collect an iterable of *pmids* (integers) into a sorted `array` of
+    unique PMIDs, using 8 bytes per PMID; unsorted input is sorted in runs
+    of `SORT_SIZE` PMIDs that are then merged.
+    """
+    values = array(TYPECODE)
+    ordered = True
+
+    for pmid in pmids:
+        if values and pmid <= values[-1]:
+            if pmid == values[-1]:
+                continue
+
+            ordered = False
+
+        values.append(pmid)
+
+    if ordered:
+        return values
+
+    logger.debug("sorting %i PMIDs", len(values))
+    runs = [array(TYPECODE, sorted(values[offset:offset + SORT_SIZE]))
+            for offset in range(0, len(values), SORT_SIZE)]
+    del values
+    result = array(TYPECODE)
+
+    for pmid in merge(*runs):
+        if not result or pmid != result[-1]:
+            result.append(pmid)
+
+    return result
+
+
+def AsPmids(pmids) -> SEQUENCES:
+    """
+    Return a sorted sequence of unique integer *pmids*: a PMID `array` or a
+    `memoryview` of a binary PMID list as is, and anything else (e.g., a
+    list of strings) as a `PmidArray`.
+    """
+    if isinstance(pmids, (array, memoryview)):
+        return pmids
+
+    return PmidArray(int(pmid) for pmid in pmids)
+
+
+def Sorted(pmids: SEQUENCES) -> SEQUENCES:
+    """
+    Return the sorted, unique *pmids*: PMID arrays (see `AsPmids`) are
+    sorted by construction, while other sequences are sorted into a list.
+    """
+    if isinstance(pmids, (array, memoryview)):
+        return pmids
+
+    return sorted(set(pmids))
+
+
+def ReadPmids(sources: list) -> SEQUENCES:
+    """
+    Read the PMIDs of all *sources*: PMIDs (integer strings), text files
+    with one PMID per line, binary PMID lists (see `WritePmids`), or
+    ``'-'`` for a text list on STDIN.
+
+    A single binary list is memory-mapped (see `LoadPmids`); otherwise,
+    the PMIDs are streamed into a `PmidArray`.
+
+    :raises ValueError: if a source is neither a PMID nor a (valid) list
+    """
+    if len(sources) == 1 and IsBinary(sources[0]):
+        return LoadPmids(sources[0])
+
+    return PmidArray(pmid for source in sources for pmid in _readSource(source))
+
+
+def _readSource(source: str) -> iter([int]):
+    """Yield the PMIDs of a single source (see `ReadPmids`)."""
+    if source == '-':
+        yield from _readLines(sys.stdin)
+    elif IsBinary(source):
+        yield from LoadPmids(source)
+    elif os.path.isfile(source):
+        with open(source) as file:
+            yield from _readLines(file)
+    else:
+        yield int(source)
+
+
+def _readLines(lines: iter([str])) -> iter([int]):
+    """Yield the PMID on each non-empty line."""
+    for line in lines:
+        line = line.strip()
+
+        if line:
+            yield int(line)
+
+
+def IsBinary(path: str) -> bool:
+    """Return ``True`` if the file at *path* is a binary PMID list."""
+    if not os.path.isfile(path):
+        return False
+
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def LoadPmids(path: str) -> memoryview:
+    """
+    Memory-map a binary PMID list and return a `memoryview` of its PMIDs
+    (which keeps the mapping open until it is released).
+
+    :raises ValueError: if the file is not a valid binary PMID list
+    """
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+
+        if file.read(len(MAGIC)) != MAGIC or (size - len(MAGIC)) % 8:
+            raise ValueError('not a binary PMID list: "{}"'.format(path))
+
+        if size == len(MAGIC):
+            return memoryview(b'').cast(TYPECODE)
+
+        data = mmap(file.fileno(), 0, access=ACCESS_READ)
+
+    if sys.byteorder != 'little':
+        values = array(TYPECODE, data[len(MAGIC):])
+        values.byteswap()
+        data.close()
+        return memoryview(values)
+
+    logger.debug("mapped %i PMIDs from %s", (size - len(MAGIC)) // 8, path)
+    return memoryview(data)[len(MAGIC):].cast(TYPECODE)
+
+
+def WritePmids(path: str, pmids: iter) -> int:
+    """
+    Write the sorted, unique *pmids* as a binary PMID list to *path* (see
+    `MAGIC`) and return the number of PMIDs written.
+    """
+    pmids = PmidArray(pmids) if not isinstance(pmids, array) else pmids
+
+    if sys.byteorder != 'little':
+        pmids = array(TYPECODE, pmids)
+        pmids.byteswap()
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        pmids.tofile(file)
+
+    logger.info("wrote %i PMIDs to %s", len(pmids), path)
+    return len(pmids)
+
+
+if __name__ == '__main__':
+    # convert PMID lists (PMIDs, text files, or '-' for STDIN) to a binary list:
+    # python -m medic.pmids OUTPUT SOURCE [SOURCE ...]
+    WritePmids(sys.argv[1], ReadPmids(sys.argv[2:]))
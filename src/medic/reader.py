@@ -0,0 +1,273 @@
+"""
+.. py:module:: medic.reader
+   :synopsis: Read-only records assembled from per-table Core queries.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+"""
+import logging
+
+from bisect import bisect_left, bisect_right
+from sqlalchemy import and_, inspect, select
+from sqlalchemy.orm import Session
+
+from medic.orm import Citation, Abstract, Section, Author, Descriptor, Qualifier, \
+    Identifier, Database, Chemical, Keyword, PublicationType, InLimit, QUERY_LIMIT
+from medic.pmids import Sorted
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = QUERY_LIMIT
+"Number of records read per batch (SQLite's default parameter limit)."
+
+
+def _attributes(entity) -> tuple:
+    """Return the names of the mapped column attributes of an ORM *entity*."""
+    return tuple(prop.key for prop in inspect(entity).column_attrs)
+
+
+class Row:
+    """
+    A read-only row of an ORM entity's table, with a slot for each mapped
+    column attribute (and any relations of the subclass).
+    """
+
+    __slots__ = ()
+    ENTITY = None
+    ATTRIBUTES = ()
+
+    def __init__(self, values):
+        for name, value in zip(self.ATTRIBUTES, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "{}<{}>".format(self.ENTITY.__name__, self.pmid)
+
+    @classmethod
+    def query(cls, pmids: list):
+        """Return a Core select of the rows for the *pmids*, ordered by primary key."""
+        table = cls.ENTITY.__table__
+        columns = [inspect(cls.ENTITY).column_attrs[name].columns[0]
+                   for name in cls.ATTRIBUTES]
+        return select(columns, table.c.pmid.in_(pmids)).order_by(*table.primary_key.columns)
+
+
+def _row(entity, relations=(), **methods) -> type:
+    """Create a `Row` class for an ORM *entity* with additional *relations* slots."""
+    attributes = _attributes(entity)
+    namespace = dict(__slots__=attributes + tuple(relations), ENTITY=entity,
+                     ATTRIBUTES=attributes, **methods)
+    return type(entity.__name__ + 'Row', (Row,), namespace)
+
+
+SectionRow = _row(Section)
+AbstractRow = _row(Abstract, ['sections'])
+AuthorRow = _row(Author, fullName=Author.fullName, shortName=Author.shortName)
+QualifierRow = _row(Qualifier)
+DescriptorRow = _row(Descriptor, ['qualifiers'])
+IdentifierRow = _row(Identifier)
+DatabaseRow = _row(Database)
+ChemicalRow = _row(Chemical)
+KeywordRow = _row(Keyword)
+PublicationTypeRow = _row(PublicationType)
+
+
+class Record(_row(Citation, [
+    'abstracts', 'authors', 'chemicals', 'databases', 'descriptors',
+    'identifiers', 'keywords', 'publication_types'
+], citation=Citation.citation)):
+    """
+    A read-only citation record with the same attributes and relations as a
+    `Citation` that the writers use (e.g., ``rec.abstracts['NLM'].sections``,
+    ``rec.authors``, or ``desc.qualifiers``), but without the ORM's
+    instrumentation, identity map, or change tracking.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, values):
+        super(Record, self).__init__(values)
+        self.abstracts = {}
+        self.identifiers = {}
+        self.authors = []
+        self.chemicals = []
+        self.databases = []
+        self.descriptors = []
+        self.keywords = []
+        self.publication_types = []
+
+
+LISTS = (
+    ('authors', AuthorRow), ('chemicals', ChemicalRow), ('databases', DatabaseRow),
+    ('keywords', KeywordRow), ('publication_types', PublicationTypeRow),
+)
+"The list relations of a `Record` and their `Row` classes."
+
+
+def read(session: Session, pmids: list, batch_size: int=BATCH_SIZE,
+         bounds: tuple=None, where: list=()) -> iter([Record]):
+    """
+    Yield a `Record` for each PMID in the DB, ordered by PMID, for a list of
+    *PMIDs* (or for all records if the list is empty), optionally only
+    within the (inclusive) PMID *bounds* (see `medic.crud.partition`) and
+    only for the citations that match all *where* predicates (see
+    `medic.crud.filters`).
+
+    For each batch of *batch_size* PMIDs, one Core ``SELECT`` per table
+    fetches the rows ordered by primary key, which are then merge-joined
+    into the records.
+    """
+    conn = session.connection()
+    count = 0
+
+    for batch in _batches(conn, pmids, batch_size, bounds, where):
+        for record in _readBatch(conn, batch):
+            count += 1
+            yield record
+
+    logger.info("read %i records", count)
+
+
+def _batches(conn, pmids: list, batch_size: int, bounds: tuple=None,
+             where: list=()) -> iter([list]):
+    """
+    Yield sorted batches of the *pmids*, or of all PMIDs (using keyset
+    pagination); batches of *pmids* filtered by *where* predicates are
+    smaller if the predicates' parameters need room (see
+    `medic.orm.InLimit`).
+    """
+    c = Citation.__table__.c
+
+    if pmids:
+        pmids = Sorted(pmids)
+
+        if bounds:
+            pmids = pmids[bisect_left(pmids, bounds[0]):bisect_right(pmids, bounds[1])]
+
+        if where:
+            batch_size = min(batch_size, InLimit(where))
+
+        for offset in range(0, len(pmids), batch_size):
+            batch = list(pmids[offset:offset + batch_size])
+
+            if where:
+                batch = [row[0] for row in conn.execute(
+                    select([c.pmid]).where(and_(c.pmid.in_(batch), *where)).order_by(c.pmid)
+                )]
+
+            if batch:
+                yield batch
+    else:
+        last = 0
+        query = select([c.pmid]).where(and_(*where))
+
+        if bounds:
+            query = query.where(c.pmid.between(*bounds))
+
+        while True:
+            batch = [row[0] for row in conn.execute(
+                query.where(c.pmid > last).order_by(c.pmid).limit(batch_size)
+            )]
+
+            if not batch:
+                break
+
+            yield batch
+            last = batch[-1]
+
+
+def _readBatch(conn, pmids: list) -> list:
+    """Read the `Record` for a batch of *pmids* and all their rows."""
+    records = [Record(row) for row in conn.execute(Record.query(pmids))]
+
+    for name, row_class in LISTS:
+        _mergeJoin(records, _rows(conn, row_class, pmids),
+                   lambda record, row, name=name: getattr(record, name).append(row))
+
+    abstracts = {}
+
+    for row in _rows(conn, AbstractRow, pmids):
+        row.sections = []
+        abstracts[row.pmid, row.source] = row
+
+    _mergeJoin(records, abstracts.values(),
+               lambda record, row: record.abstracts.__setitem__(row.source, row))
+
+    for row in _rows(conn, SectionRow, pmids):
+        abstracts[row.pmid, row.source].sections.append(row)
+
+    descriptors = {}
+
+    for row in _rows(conn, DescriptorRow, pmids):
+        row.qualifiers = []
+        descriptors[row.pmid, row.num] = row
+
+    _mergeJoin(records, descriptors.values(),
+               lambda record, row: record.descriptors.append(row))
+
+    for row in _rows(conn, QualifierRow, pmids):
+        descriptors[row.pmid, row.num].qualifiers.append(row)
+
+    _mergeJoin(records, _rows(conn, IdentifierRow, pmids),
+               lambda record, row: record.identifiers.__setitem__(row.namespace, row))
+    return records
+
+
+def _rows(conn, row_class: type, pmids: list) -> iter:
+    """Yield the *row_class* instances for the *pmids*, ordered by primary key."""
+    return map(row_class, conn.execute(row_class.query(pmids)))
+
+
+def _mergeJoin(records: list, rows: iter, attach):
+    """
+    Merge-join *rows* with the *records* (both ordered by PMID) and
+    *attach* each row to the record with its PMID.
+    """
+    records = iter(records)
+    record = next(records, None)
+
+    for row in rows:
+        while record is not None and record.pmid < row.pmid:
+            record = next(records, None)
+
+        if record is None:
+            break
+
+        if record.pmid == row.pmid:
+            attach(record, row)
+
+
+def benchmark(url: str, pmids: list=()) -> dict:
+    """
+    Compare the time to format records as HTML (using all the relations of
+    the records) with the ORM (`crud.select`) and with `read`; run as
+    ``python -m medic.reader URL [PMID ...]`` (no PMIDs: all records).
+
+    :return: a `dict` with the seconds taken by the ``orm`` and ``reader``
+    """
+    from time import time
+    from medic.crud import select as selectCitations, WRITE_RELATIONS
+    from medic.orm import InitDb, Session as NewSession
+    from medic.web import FormatHTML
+
+    InitDb(url)
+    timings = {}
+
+    for name, records in (
+        ('orm', lambda s: selectCitations(s, list(pmids), WRITE_RELATIONS['html'])),
+        ('reader', lambda s: read(s, list(pmids))),
+    ):
+        session = NewSession()
+        start = time()
+        size = len(FormatHTML(records(session)))
+        timings[name] = time() - start
+        session.close()
+        print('{}: {:.3f}s ({} characters)'.format(name, timings[name], size))
+
+    return timings
+
+
+if __name__ == '__main__':
+    import sys
+
+    benchmark(sys.argv[1], [int(pmid) for pmid in sys.argv[2:]])
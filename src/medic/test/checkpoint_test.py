@@ -0,0 +1,112 @@
+import json
+import unittest
+
+from collections import namedtuple
+from datetime import date
+from os.path import exists, join
+from tempfile import TemporaryDirectory
+
+from medic.checkpoint import Checkpoint, Selection, MAX_PMID
+from medic.crud import BackgroundWriter, filters
+
+Record = namedtuple('Record', 'pmid')
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.output = join(self.dir.name, 'out.txt')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def checkpoint(self, selection='all'):
+        checkpoint = Checkpoint(self.output, 'medline', selection, interval=3)
+        checkpoint.load()
+        return checkpoint
+
+    def export(self, pmids, fail_at=None, background=0):
+        """Write one "<pmid> ä" line per PMID, stopping at PMID *fail_at*."""
+        checkpoint = self.checkpoint()
+        records = (Record(pmid) for pmid in pmids
+                   if checkpoint.bounds is None or pmid >= checkpoint.bounds[0])
+        file = checkpoint.open()
+        stream = checkpoint.stream = BackgroundWriter(file, background) if background else file
+
+        try:
+            for record in checkpoint.track(records):
+                if record.pmid == fail_at:
+                    raise Interrupted()
+
+                stream.write('{} ä\n'.format(record.pmid))
+        finally:
+            if background:
+                stream.close()
+
+            file.close()
+
+        checkpoint.finish()
+
+    def read(self):
+        with open(self.output, encoding='utf-8') as file:
+            return file.read()
+
+    def testSavesAtIntervals(self):
+        self.assertRaises(Interrupted, self.export, range(1, 11), 8)
+
+        with open(self.output + '.checkpoint') as file:
+            state = json.load(file)
+
+        self.assertEqual(6, state['pmid'])
+        self.assertEqual(6, state['records'])
+        self.assertEqual(len(''.join('{} ä\n'.format(i) for i in range(1, 7)).encode()),
+                         state['offset'])
+        self.assertEqual((7, MAX_PMID), self.checkpoint().bounds)
+
+    def testResumesIdentically(self):
+        expected = ''.join('{} ä\n'.format(i) for i in range(1, 11))
+        self.assertRaises(Interrupted, self.export, range(1, 11), 8)
+        self.export(range(1, 11))
+        self.assertEqual(expected, self.read())
+        self.assertFalse(exists(self.output + '.checkpoint'))
+
+    def testResumesWithBackgroundWriter(self):
+        expected = ''.join('{} ä\n'.format(i) for i in range(1, 11))
+        self.assertRaises(Interrupted, self.export, range(1, 11), 5, 1)
+        self.assertEqual(3, self.checkpoint().pmid)
+        self.export(range(1, 11), background=1)
+        self.assertEqual(expected, self.read())
+
+    def testNotResumed(self):
+        checkpoint = self.checkpoint()
+        self.assertFalse(checkpoint.resumed)
+        self.assertIsNone(checkpoint.bounds)
+
+    def testRejectsOtherExports(self):
+        self.assertRaises(Interrupted, self.export, range(1, 11), 5)
+        self.assertRaises(ValueError, self.checkpoint, 'other')
+
+    def testRejectsShortOutput(self):
+        self.assertRaises(Interrupted, self.export, range(1, 11), 5)
+
+        with open(self.output, 'w') as file:
+            file.write('1')
+
+        self.assertRaises(ValueError, self.checkpoint().open)
+
+    def testSelection(self):
+        self.assertEqual(Selection([]), Selection([]))
+        self.assertEqual(Selection([2, 1]), Selection(['1', '2']))
+        self.assertNotEqual(Selection([]), Selection([1]))
+        where = filters(years=(2000, 2001), modified_since=date(2016, 1, 1))
+        self.assertEqual(Selection([], where), Selection([], list(where)))
+        self.assertNotEqual(Selection([], where), Selection([], filters(years=(2000, 2002))))
+
+
+if __name__ == '__main__':
+    unittest.main()
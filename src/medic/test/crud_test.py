@@ -1,13 +1,30 @@
 import unittest
 
 from collections import defaultdict
-from datetime import date
+from functools import partial
+from datetime import date, timedelta
 from io import StringIO
-from tempfile import TemporaryFile
+from os.path import join
+from queue import Queue
+from sqlite3 import dbapi2
+from tempfile import TemporaryFile, TemporaryDirectory
+from threading import current_thread
 
-from medic.orm import Citation, Section, Author, Descriptor, Qualifier, Database, Identifier, \
-    Chemical, Keyword, PublicationType, Abstract
-from medic.crud import _dump
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from medic.orm import InitDb, Session, Citation, Section, Author, Descriptor, Qualifier, \
+    Database, Identifier, Chemical, Keyword, PublicationType, Abstract
+from medic.crud import _dump, _streamInstances, _Loader, _CoreLoader, _UpdateLoader, \
+    _createStaging, _applyUpdate, _collectCitation, _Pipeline, sync, update, \
+    _updatePartitions, _updateWorker, delete, stats, select, partition, tabulate, tiab, \
+    _unquote, prefetch, _batched, BackgroundWriter, filters, fanout, WRITE_RELATIONS, \
+    END_OF_FILE, _textQuery, _copySql
+from medic.orm import AsRow, Fingerprint, UpdateFile, QUERY_LIMIT
+from medic.reader import read
+
+URI = "sqlite+pysqlite://"  # use in-memmory SQLite DB for testing
 
 DATA = [
     Abstract(1, 'NLM'),
@@ -75,5 +92,966 @@ class TestDump(unittest.TestCase):
             self.assertEqual(results[tbl], buff.getvalue())
 
 
+def CitationStream(pmids):
+    """Generate the instances of a minimal citation for each PMID."""
+    for pmid in pmids:
+        yield Citation(pmid, 'MEDLINE', 'title', 'journal', '1990 pub_date', date.today())
+        yield Abstract(pmid, 'NLM')
+        yield Section(pmid, 'NLM', 1, 'Abstract', 'The Abstract')
+        yield Author(pmid, 1, 'author')
+
+
+class TestBatchedLoading(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        self.sizes = []
+        event.listen(self.sess, 'before_commit', self.recordSize)
+
+    def recordSize(self, session):
+        self.sizes.append(len(session.identity_map) + len(session.new))
+
+    def load(self, pmids, batch_size):
+        loader = _Loader(self.sess, self.sess.add, batch_size)
+        count = _streamInstances(self.sess, loader, CitationStream(pmids))
+        loader.commit()
+        return loader, count
+
+    def testBatchCommits(self):
+        loader, count = self.load(range(1, 26), 10)
+        self.assertEqual(25, count)
+        self.assertEqual(3, loader.batches)
+        self.assertEqual(25, loader.count)
+        self.assertEqual(25, self.sess.query(Citation).count())
+        self.assertEqual(25, self.sess.query(Section).count())
+
+    def testMemoryStaysConstant(self):
+        self.load(range(1, 101), 10)
+        # ten full batches and a final commit with nothing left to send
+        self.assertListEqual([10 * 4] * 10 + [0], self.sizes)
+        self.assertEqual(0, len(self.sess.identity_map))
+
+    def testWithoutBatches(self):
+        loader, count = self.load(range(1, 26), 0)
+        self.assertEqual(1, loader.batches)
+        self.assertListEqual([25 * 4], self.sizes)
+
+
+class TestRejects(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        self.dir = TemporaryDirectory()
+        self.reject_file = join(self.dir.name, 'rejects.tsv')
+        self.load(_Loader(self.sess, self.sess.add), CitationStream(range(1, 6)))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def load(self, loader, stream):
+        _streamInstances(self.sess, loader, stream)
+        loader.commit()
+        loader.close()
+        return loader
+
+    def rejected(self):
+        with open(self.reject_file) as f:
+            return [int(line.split('\t')[0]) for line in f]
+
+    def pmids(self):
+        return [pmid for pmid, in self.sess.query(Citation.pmid).order_by(Citation.pmid)]
+
+    def testRejectDuplicates(self):
+        loader = _Loader(self.sess, self.sess.add, 3, self.reject_file)
+        loader = self.load(loader, CitationStream([6, 4, 7, 8, 5, 9]))
+        self.assertEqual(2, loader.rejected)
+        self.assertListEqual([4, 5], self.rejected())
+        self.assertListEqual(list(range(1, 10)), self.pmids())
+        self.assertEqual(9, self.sess.query(Section).count())
+        self.assertListEqual(stats(self.sess), stats(self.sess, recount=True))
+
+    def testRejectDuplicatesWithCore(self):
+        loader = _CoreLoader(self.sess, 3, self.reject_file)
+        self.load(loader, CitationStream([6, 4, 7, 8, 5, 9]))
+        self.assertListEqual([4, 5], self.rejected())
+        self.assertListEqual(list(range(1, 10)), self.pmids())
+        self.assertListEqual(stats(self.sess), stats(self.sess, recount=True))
+
+    def testRejectUpdates(self):
+        loader = _UpdateLoader(self.sess, 0, self.reject_file)
+        stream = list(FullCitationStream([6, 7])) + [Author(10, 1, 'orphan')]
+        self.load(loader, stream)
+        self.assertListEqual([10], self.rejected())
+        self.assertListEqual(list(range(1, 8)), self.pmids())
+        self.assertEqual(2, loader.counts['citations']['inserted'])
+        self.assertEqual(self.sess.query(Author).filter(Author.pmid > 5).count(),
+                         loader.counts['authors']['inserted'])
+        self.assertListEqual(stats(self.sess), stats(self.sess, recount=True))
+
+    def testFailWithoutRejectFile(self):
+        loader = _Loader(self.sess, self.sess.add, 3)
+
+        with self.assertRaises(IntegrityError):
+            self.load(loader, CitationStream([6, 4, 7]))
+
+
+class TestPipeline(unittest.TestCase):
+
+    def testYieldsAllItems(self):
+        pipeline = _Pipeline(iter(range(100)), 3)
+        self.assertListEqual(list(range(100)), list(pipeline))
+
+    def testRecordsStalls(self):
+        pipeline = _Pipeline(iter(range(10)), 1)
+        list(pipeline)
+        self.assertTrue(pipeline.producer_stall >= 0.0)
+        self.assertTrue(pipeline.consumer_stall > 0.0)
+
+    def testRaisesProducerErrors(self):
+        def failing():
+            yield 1
+            raise ValueError('parse error')
+
+        pipeline = _Pipeline(failing(), 2)
+        items = []
+
+        with self.assertRaises(ValueError):
+            for i in pipeline:
+                items.append(i)
+
+        self.assertListEqual([1], items)
+
+    def testStopsProducerWhenClosed(self):
+        pipeline = _Pipeline(iter(range(1000)), 2)
+        iterator = iter(pipeline)
+        self.assertEqual(0, next(iterator))
+        iterator.close()
+        self.assertTrue(pipeline.stopped.is_set())
+
+    def testMeasuresOverlap(self):
+        pipeline = _Pipeline(iter(range(10)), 2)
+        list(pipeline)
+        self.assertTrue(pipeline.busy >= 0.0)
+        self.assertTrue(0.0 <= pipeline.overlap <= 1.0)
+
+    def testClosesGeneratorInProducer(self):
+        closed = []
+
+        def items():
+            try:
+                yield from range(1000)
+            finally:
+                closed.append(current_thread().name)
+
+        iterator = iter(_Pipeline(items(), 2))
+        next(iterator)
+        iterator.close()
+        self.assertListEqual(['medic-pipeline'], closed)
+
+    def testStreamsInstances(self):
+        InitDb(URI, module=dbapi2)
+        sess = Session()
+        loader = _Loader(sess, sess.add, 10)
+        count = _streamInstances(sess, loader, CitationStream(range(1, 26)), 5)
+        loader.commit()
+        self.assertEqual(25, count)
+        self.assertEqual(25, sess.query(Citation).count())
+        self.assertEqual(25, sess.query(Section).count())
+
+
+def FullCitationStream(pmids):
+    """Generate the instances of a citation with all entities for each PMID."""
+    for pmid in pmids:
+        yield Citation(pmid, 'MEDLINE', 'title', 'journal', '1990 pub_date', date.today(),
+                       revised=date(2000, 1, 1), issue='1(2)')
+        yield Abstract(pmid, 'NLM', 'copyright')
+        yield Section(pmid, 'NLM', 1, 'Background', 'The Abstract 1', 'BG')
+        yield Section(pmid, 'NLM', 2, 'Abstract', 'The Abstract 2', truncated=True)
+        yield Descriptor(pmid, 1, 'd_name', True)
+        yield Descriptor(pmid, 2, 'd_name')
+        yield Qualifier(pmid, 1, 1, 'q_name', True)
+        yield Author(pmid, 1, 'first', 'F', 'Fore')
+        yield Author(pmid, 2, 'last')
+        yield Identifier(pmid, 'doi', 'id/{}'.format(pmid))
+        yield Database(pmid, 'name', 'accession')
+        yield PublicationType(pmid, 'some')
+        yield PublicationType(pmid, 'some')  # duplicates are dropped
+        yield Chemical(pmid, 1, 'name', 'uid')
+        yield Keyword(pmid, 'NOTNLM', 1, 'name', True)
+
+
+class TestCoreLoading(unittest.TestCase):
+
+    def load(self, loader_factory, pmids):
+        InitDb(URI, module=dbapi2)
+        sess = Session()
+        loader = loader_factory(sess)
+        count = _streamInstances(sess, loader, FullCitationStream(pmids))
+        loader.commit()
+        tables = (Citation,) + Citation.CHILDREN
+        return count, sorted(str(i) for t in tables for i in sess.query(t))
+
+    def testSameAsOrm(self):
+        pmids = range(1, 8)
+        orm_count, orm_rows = self.load(lambda s: _Loader(s, s.add), pmids)
+        core_count, core_rows = self.load(lambda s: _CoreLoader(s, 3), pmids)
+        self.assertEqual(7, core_count)
+        self.assertEqual(orm_count, core_count)
+        self.assertEqual(7 * 14, len(core_rows))
+        self.assertListEqual(orm_rows, core_rows)
+
+    def testBatches(self):
+        InitDb(URI, module=dbapi2)
+        sess = Session()
+        loader = _CoreLoader(sess, 3)
+        _streamInstances(sess, loader, FullCitationStream(range(1, 8)))
+        self.assertEqual(2, loader.batches)
+        self.assertEqual(6, sess.query(Citation).count())
+        loader.commit()
+        self.assertEqual(3, loader.batches)
+        self.assertEqual(7, sess.query(Citation).count())
+
+
+class TestDelete(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _CoreLoader(self.sess)
+        _streamInstances(self.sess, loader, FullCitationStream(range(1, 1201)))
+        loader.commit()
+
+    def testDeletePmids(self):
+        self.assertTrue(delete(self.sess, list(range(1, 1101)) + [1, 9999]))
+        self.assertEqual(100, self.sess.query(Citation).count())
+        self.assertEqual(200, self.sess.query(Section).count())
+        self.assertEqual(100, self.sess.query(Qualifier).count())
+        self.assertEqual(1101, self.sess.query(Citation.pmid).order_by(Citation.pmid).first()[0])
+
+    def testDeleteAll(self):
+        self.assertTrue(delete(self.sess, []))
+        self.assertEqual(0, self.sess.query(Citation).count())
+        self.assertEqual(0, self.sess.query(Descriptor).count())
+        loader = _Loader(self.sess, self.sess.add)
+        _streamInstances(self.sess, loader, FullCitationStream([1]))
+        loader.commit()
+        self.assertEqual(1, self.sess.query(Citation).count())
+
+    def testDeleteRejectsNonList(self):
+        self.assertFalse(delete(self.sess, None))
+
+
+class TestSelect(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _CoreLoader(self.sess)
+        _streamInstances(self.sess, loader, FullCitationStream(range(1, 1201)))
+        loader.commit()
+        self.queries = 0
+        event.listen(self.sess.get_bind(), 'before_cursor_execute', self.countQuery)
+
+    def tearDown(self):
+        event.remove(self.sess.get_bind(), 'before_cursor_execute', self.countQuery)
+
+    def countQuery(self, *_):
+        self.queries += 1
+
+    def touch(self, record):
+        """Access all relations the MEDLINE and HTML writers use."""
+        for abstract in record.abstracts.values():
+            list(abstract.sections)
+
+        for descriptor in record.descriptors:
+            list(descriptor.qualifiers)
+
+        return (len(record.authors), len(record.chemicals), len(record.databases),
+                len(record.identifiers), len(record.keywords),
+                len(record.publication_types))
+
+    def testEagerLoading(self):
+        records = select(self.sess, list(range(1, 1201)), WRITE_RELATIONS['full'])
+        relations = [self.touch(record) for record in records]
+        self.assertEqual(1200, len(relations))
+        self.assertEqual({(2, 1, 1, 1, 1, 1)}, set(relations))
+        # 2 chunks, each with 1 citation query and 10 relation queries
+        # (that in turn are split into 500-record IN-lists by SQL Alchemy)
+        self.assertTrue(self.queries <= 2 * 11 * 2, self.queries)
+
+    def testLazyLoading(self):
+        for record in select(self.sess, list(range(1, 11))):
+            self.touch(record)
+
+        self.assertTrue(self.queries > 10 * 10, self.queries)
+
+    def testSelectAll(self):
+        pmids = [r.pmid for r in select(self.sess, [], WRITE_RELATIONS['tsv'])]
+        self.assertListEqual(list(range(1, 1201)), pmids)
+        self.assertEqual(0, len(self.sess.identity_map))
+
+    def testSelectAllInPages(self):
+        records = select(self.sess, [], WRITE_RELATIONS['tsv'])
+        first = next(records)
+        self.assertEqual(1, first.pmid)
+        self.assertEqual(5, self.queries)  # the page, its abstracts and sections (2 x 500)
+        rest = [r for r in records]
+        self.assertEqual(1199, len(rest))
+        self.assertEqual(2, len(first.abstracts['NLM'].sections))  # expunged, but loaded
+        self.assertEqual(1200, rest[-1].pmid)
+
+    def testPartitionAll(self):
+        self.assertListEqual([(1, 400), (401, 800), (801, 1200)],
+                             partition(self.sess, [], 3))
+
+    def testPartitionMoreThanRecords(self):
+        delete(self.sess, list(range(3, 1201)))
+        self.assertListEqual([(1, 1), (2, 2)], partition(self.sess, [], 5))
+
+    def testPartitionPmids(self):
+        self.assertListEqual([[1, 2, 3], [5, 8]], partition(self.sess, [8, 3, 2, 5, 1, 3], 2))
+
+    def testSelectBounds(self):
+        pmids = [r.pmid for r in select(self.sess, [], bounds=(401, 1002))]
+        self.assertListEqual(list(range(401, 1003)), pmids)
+
+    def testSnapshotFallsBackToPages(self):
+        with self.assertLogs('medic.crud', 'WARNING'):
+            count = sum(1 for _ in select(self.sess, [], (), snapshot=True))
+
+        self.assertEqual(1200, count)
+
+
+def TextCitationStream():
+    """Generate citations with the abstract cases the TSV and TIAB writers handle."""
+    today = date.today()
+    yield Citation(1, 'MEDLINE', 'the\ttitle\n1', 'journal', '1990', today)
+    yield Abstract(1, 'Publisher')
+    yield Section(1, 'Publisher', 1, 'Abstract', 'ignored')
+    yield Abstract(1, 'NLM')
+    yield Section(1, 'NLM', 2, 'Methods', 'second\tsection', 'METHODS')
+    yield Section(1, 'NLM', 1, 'Background', 'first\nsection', 'BG')
+    yield Section(1, 'NLM', 10, 'Abstract', 'last')
+    yield Citation(2, 'MEDLINE', 'title 2', 'journal', '1990', today)
+    yield Abstract(2, 'Publisher')
+    yield Section(2, 'Publisher', 1, 'Abstract', 'only')
+    yield Citation(3, 'MEDLINE', 'title 3', 'journal', '1990', today)
+    yield Abstract(3, 'Publisher')
+    yield Section(3, 'Publisher', 1, 'Abstract', 'ambiguous')
+    yield Abstract(3, 'KIE')
+    yield Section(3, 'KIE', 1, 'Abstract', 'ambiguous')
+    yield Citation(4, 'MEDLINE', 'title 4', 'journal', '1990', today)
+    yield Citation(5, 'MEDLINE', 'title 5', 'journal', '1990', today)
+    yield Abstract(5, 'NLM')
+
+
+class TestText(unittest.TestCase):
+
+    TSV = [
+        '1\tthe title 1\tfirst section second section last\n',
+        '2\ttitle 2\tonly\n',
+        '3\ttitle 3\t\n',
+        '4\ttitle 4\t\n',
+        '5\ttitle 5\t\n',
+    ]
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _Loader(self.sess, self.sess.add)
+        _streamInstances(self.sess, loader, TextCitationStream())
+        loader.commit()
+
+    def testTabulateAll(self):
+        file = StringIO()
+        self.assertEqual(5, tabulate(self.sess, [], file))
+        self.assertEqual(''.join(self.TSV), file.getvalue())
+
+    def testTabulatePmids(self):
+        file = StringIO()
+        self.assertEqual(2, tabulate(self.sess, [3, 1, 9], file))
+        self.assertEqual(self.TSV[0] + self.TSV[2], file.getvalue())
+
+    def testTiab(self):
+        texts = dict(tiab(self.sess, []))
+        self.assertListEqual([1, 2, 3, 4, 5], sorted(texts))
+        self.assertEqual('the\ttitle\n1\n\nBG\nfirst\nsection\n\nMETHODS\n'
+                         'second\tsection\n\nlast\n', texts[1])
+        self.assertEqual('title 2\n\nonly\n', texts[2])
+        self.assertEqual('title 3\n', texts[3])
+        self.assertEqual('title 4\n', texts[4])
+        self.assertEqual('title 5\n', texts[5])
+
+    def testTiabPmids(self):
+        self.assertListEqual([2], [pmid for pmid, _ in tiab(self.sess, [2, 6])])
+
+    def testUnquoteCopyFields(self):
+        self.assertEqual('plain', _unquote('plain'))
+        self.assertEqual('', _unquote('\x01\x01'))
+        self.assertEqual('a\rb\x01c\x02', _unquote('\x01a\rb\x02\x01c\x02\x02\x01'))
+
+
+def FilterCitationStream():
+    """Generate citations that differ in each attribute `filters` can select."""
+    for pmid, status, journal, year, mesh, pubtype, modified in (
+        (1, 'MEDLINE', 'A', 1990, 'Humans', 'Review', date(2015, 1, 1)),
+        (2, 'MEDLINE', 'B', 1995, 'Mice', 'Journal Article', date(2016, 1, 1)),
+        (3, 'In-Process', 'A', 2000, 'Humans', 'Journal Article', date(2017, 1, 1)),
+        (4, 'Publisher', 'C', 2005, 'Mice', 'Review', date(2018, 1, 1)),
+    ):
+        citation = Citation(pmid, status, 'title', journal, '{} pub_date'.format(year),
+                            date(2000, 1, 1))
+        citation.modified = modified
+        yield citation
+        yield Abstract(pmid, 'NLM')
+        yield Section(pmid, 'NLM', 1, 'Abstract', 'abstract {}'.format(pmid))
+        yield Descriptor(pmid, 1, mesh)
+        yield Descriptor(pmid, 2, 'Animals')
+        yield PublicationType(pmid, pubtype)
+
+
+class TestFilters(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _Loader(self.sess, self.sess.add)
+        _streamInstances(self.sess, loader, FilterCitationStream())
+        loader.commit()
+
+    def pmids(self, pmids=(), **criteria):
+        return [r.pmid for r in select(self.sess, list(pmids), where=filters(**criteria))]
+
+    def testNoFilters(self):
+        self.assertListEqual([], filters())
+        self.assertListEqual([1, 2, 3, 4], self.pmids())
+
+    def testYears(self):
+        self.assertListEqual([2, 3], self.pmids(years=(1991, 2000)))
+        self.assertListEqual([4], self.pmids(years=(2005, 2005)))
+
+    def testJournals(self):
+        self.assertListEqual([1, 3, 4], self.pmids(journals=['A', 'C']))
+
+    def testStates(self):
+        self.assertListEqual([3, 4], self.pmids(states=['In-Process', 'Publisher']))
+
+    def testMesh(self):
+        self.assertListEqual([2, 4], self.pmids(mesh=['Mice']))
+        self.assertListEqual([1, 2, 3, 4], self.pmids(mesh=['Animals', 'Mice']))
+
+    def testPublicationTypes(self):
+        self.assertListEqual([1, 4], self.pmids(pubtypes=['Review']))
+
+    def testModifiedSince(self):
+        self.assertListEqual([3, 4], self.pmids(modified_since=date(2016, 6, 1)))
+
+    def testCombined(self):
+        self.assertListEqual([1], self.pmids(journals=['A'], mesh=['Humans'],
+                                             pubtypes=['Review']))
+        self.assertListEqual([3, 4], self.pmids([3, 4, 9], mesh=['Humans', 'Mice'],
+                                                years=(2000, 2010)))
+        self.assertListEqual([4], self.pmids([3, 4, 9], mesh=['Humans', 'Mice'],
+                                             states=['MEDLINE', 'Publisher']))
+
+    def testPartition(self):
+        self.assertListEqual([(2, 3), (4, 4)],
+                             partition(self.sess, [], 2, filters(mesh=['Mice'])))
+        self.assertListEqual([], partition(self.sess, [], 2, filters(journals=['X'])))
+
+    def testRead(self):
+        where = filters(pubtypes=['Journal Article'])
+        self.assertListEqual([2, 3], [r.pmid for r in read(self.sess, [], where=where)])
+        self.assertListEqual([3], [r.pmid for r in read(self.sess, [1, 3], where=where)])
+
+    def testText(self):
+        where = filters(journals=['A'])
+        file = StringIO()
+        self.assertEqual(2, tabulate(self.sess, [], file, where))
+        self.assertEqual('1\ttitle\tabstract 1\n3\ttitle\tabstract 3\n', file.getvalue())
+        self.assertListEqual([(3, 'title\n\nabstract 3\n')],
+                             list(tiab(self.sess, [2, 3], where)))
+
+    def testParameterLimit(self):
+        parameters = []
+        listener = lambda conn, cursor, statement, params, context, many: \
+            parameters.append(len(params))
+        engine = self.sess.get_bind()
+        event.listen(engine, 'before_cursor_execute', listener)
+        pmids = list(range(1, 3000))
+        where = filters(journals=['A', 'C'], years=(1990, 2010))
+
+        try:
+            self.assertListEqual([1, 3, 4], [r.pmid for r in select(self.sess, pmids, where=where)])
+            self.assertListEqual([1, 3, 4], [r.pmid for r in read(self.sess, pmids, where=where)])
+            self.assertEqual(3, tabulate(self.sess, pmids, StringIO(), where))
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+
+        self.assertLessEqual(max(parameters), QUERY_LIMIT)
+
+    def testCopyPostgreSQL(self):
+        class Cursor:
+            def mogrify(self, sql, params):
+                return (sql % {k: "'{}'".format(v) for k, v in params.items()}).encode()
+
+        where = filters(years=(1990, 2010), journals=['A'], states=['MEDLINE'],
+                        mesh=['Humans'], pubtypes=['Review'],
+                        modified_since=date(2016, 1, 1))
+
+        for output_format in ('tsv', 'tiab'):
+            query = _textQuery('postgresql', output_format, [1, 2], where)
+            sql = _copySql(Cursor(), query, postgresql.dialect()).decode()
+            self.assertTrue(sql.startswith('COPY (WITH selection AS'), sql)
+            self.assertIn("citations.modified >= '2016-01-01'", sql)
+            self.assertTrue(sql.endswith("ESCAPE E'\\x02')"), sql)
+
+    def testDeleteAll(self):
+        self.assertTrue(delete(self.sess, [], filters(states=['MEDLINE'])))
+        self.assertListEqual([3, 4], self.pmids())
+        self.assertEqual(4, self.sess.query(Descriptor).count())
+        self.assertEqual(2, self.sess.query(Section).count())
+
+    def testDeletePmids(self):
+        self.assertTrue(delete(self.sess, [1, 2, 3], filters(mesh=['Humans'])))
+        self.assertListEqual([2, 4], self.pmids())
+        self.assertEqual(4, self.sess.query(Descriptor).count())
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        InitDb('sqlite+pysqlite:///' + join(self.dir.name, 'medline.db'))
+        self.sess = Session()
+        loader = _CoreLoader(self.sess)
+        _streamInstances(self.sess, loader, FullCitationStream(range(1, 1201)))
+        loader.commit()
+
+    def tearDown(self):
+        self.sess.close()
+        self.dir.cleanup()
+
+    def testPrefetchAll(self):
+        records = prefetch(self.sess, partial(
+            select, pmids=[], relations=WRITE_RELATIONS['full']
+        ), 2)
+        pmids = []
+
+        for record in records:
+            self.assertEqual(1, len(record.descriptors[0].qualifiers))
+            pmids.append(record.pmid)
+
+        self.assertListEqual(list(range(1, 1201)), pmids)
+
+    def testInMemoryFallback(self):
+        InitDb(URI, module=dbapi2)
+        sess = Session()
+
+        with self.assertLogs('medic.crud', 'WARNING'):
+            self.assertListEqual([], list(prefetch(sess, partial(select, pmids=[]), 2)))
+
+    def testBatched(self):
+        self.assertListEqual([[0, 1], [2, 3], [4]], list(_batched(range(5), 2)))
+
+
+class TestFanout(unittest.TestCase):
+
+    def testFeedsAllConsumers(self):
+        results = [[], [], []]
+        consumers = [result.extend for result in results]
+        self.assertEqual(2500, fanout(iter(range(2500)), consumers))
+
+        for result in results:
+            self.assertListEqual(list(range(2500)), result)
+
+    def testConsumersRunInThreads(self):
+        names = []
+        fanout(range(3), [lambda items: names.append(current_thread().name) or list(items)])
+        self.assertListEqual(['medic-fanout-0'], names)
+
+    def testRaisesConsumerErrors(self):
+        produced = []
+        result = []
+
+        def items():
+            for i in range(10000):
+                produced.append(i)
+                yield i
+
+        def failing(items):
+            next(items)
+            raise ValueError('write error')
+
+        with self.assertRaises(ValueError):
+            fanout(items(), [result.extend, failing], depth=1)
+
+        self.assertTrue(len(produced) < 10000, len(produced))
+        self.assertListEqual(produced[:len(result)], result)
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def testWritesAllChunks(self):
+        file = StringIO()
+        writer = BackgroundWriter(file, 1, 10)
+
+        for i in range(100):
+            print(i, file=writer)
+
+        writer.close()
+        self.assertEqual(''.join('{}\n'.format(i) for i in range(100)), file.getvalue())
+        self.assertFalse(file.closed)
+        self.assertTrue(writer.write_stall >= 0.0)
+
+    def testRaisesWriteErrors(self):
+        file = StringIO()
+        file.close()
+        writer = BackgroundWriter(file, 1, 1)
+        writer.write('text')
+
+        with self.assertRaises(ValueError):
+            writer.close()
+
+
+class TestStatistics(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+
+    def load(self, loader, stream):
+        _streamInstances(self.sess, loader, stream)
+        loader.commit()
+
+    def assertCounted(self):
+        counts = stats(self.sess)
+        self.assertListEqual(stats(self.sess, recount=True), counts)
+        return {(name, key): count for name, key, count in counts}
+
+    def testLoaders(self):
+        self.load(_Loader(self.sess, self.sess.add), FullCitationStream(range(1, 4)))
+        self.load(_CoreLoader(self.sess), FullCitationStream(range(4, 6)))
+        counts = self.assertCounted()
+        self.assertEqual(5, counts['citations', ''])
+        self.assertEqual(5, counts['citations', 'year:1990'])
+        self.assertEqual(5, counts['citations', 'status:MEDLINE'])
+        self.assertEqual(10, counts['sections', ''])
+
+    def testUpdate(self):
+        self.load(_UpdateLoader(self.sess), FullCitationStream(range(1, 4)))
+        stream = list(FullCitationStream(range(2, 5)))
+        stream[0].status = 'Publisher'
+        del stream[6]  # qualifier 1:1 of PMID 2
+        self.load(_UpdateLoader(self.sess), stream)
+        counts = self.assertCounted()
+        self.assertEqual(4, counts['citations', ''])
+        self.assertEqual(1, counts['citations', 'status:Publisher'])
+        self.assertEqual(3, counts['qualifiers', ''])
+        self.assertEqual(4, counts['fingerprints', ''])
+
+    def testDelete(self):
+        self.load(_CoreLoader(self.sess), FullCitationStream(range(1, 6)))
+        self.assertTrue(delete(self.sess, [2, 4]))
+        counts = self.assertCounted()
+        self.assertEqual(3, counts['citations', 'year:1990'])
+        self.assertTrue(delete(self.sess, []))
+        self.assertListEqual([], stats(self.sess))
+
+    def testApply(self):
+        self.load(_CoreLoader(self.sess), FullCitationStream(range(1, 4)))
+        data = defaultdict(list)
+
+        for citation in _collectCitation(FullCitationStream(range(3, 6))):
+            for i in citation:
+                data[i.__tablename__].append(AsRow(i))
+
+        conn = self.sess.get_bind().connect()
+        _applyUpdate(conn, _createStaging(conn), data, {1})
+        self.assertEqual(4, self.assertCounted()['citations', ''])
+
+    def testWarnWithoutStatistics(self):
+        Citation.insert({'citations': [AsRow(next(CitationStream([1])))]})
+
+        with self.assertLogs('medic.crud', 'WARNING'):
+            self.assertListEqual([], stats(self.sess))
+
+
+class TestApply(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _Loader(self.sess, self.sess.add)
+        _streamInstances(self.sess, loader, FullCitationStream(range(1, 6)))
+        loader.commit()
+
+    def testApplyUpdate(self):
+        data = defaultdict(list)
+
+        for citation in _collectCitation(FullCitationStream(range(4, 8))):
+            for i in citation:
+                if isinstance(i, Citation):
+                    i.title = 'updated'
+                data[i.__tablename__].append(AsRow(i))
+
+        conn = self.sess.get_bind().connect()
+        staging = _createStaging(conn)
+        _applyUpdate(conn, staging, data, {1, 8})
+        self.sess.expire_all()
+        titles = dict(self.sess.query(Citation.pmid, Citation.title))
+        self.assertDictEqual({2: 'title', 3: 'title', 4: 'updated', 5: 'updated',
+                              6: 'updated', 7: 'updated'}, titles)
+        self.assertEqual(12, self.sess.query(Section).count())
+        self.assertEqual(6, self.sess.query(Qualifier).count())
+        self.assertEqual(6, self.sess.query(PublicationType).count())
+
+
+class TestUpdateLoading(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        self.yesterday = date.today() - timedelta(days=1)
+
+    def update(self, stream):
+        loader = _UpdateLoader(self.sess)
+        _streamInstances(self.sess, loader, stream)
+        loader.commit()
+        return loader
+
+    def age(self):
+        self.sess.query(Citation).update({'modified': self.yesterday})
+        self.sess.commit()
+
+    def modified(self):
+        return dict(self.sess.query(Citation.pmid, Citation.modified))
+
+    def testStoresFingerprints(self):
+        loader = self.update(FullCitationStream(range(1, 4)))
+        self.assertEqual(0, loader.skipped)
+        self.assertEqual(3, self.sess.query(Fingerprint).count())
+
+    def testSkipsUnchanged(self):
+        self.update(FullCitationStream(range(1, 4)))
+        self.age()
+        loader = self.update(FullCitationStream(range(1, 5)))
+        self.assertEqual(3, loader.skipped)
+        self.assertDictEqual({1: self.yesterday, 2: self.yesterday, 3: self.yesterday,
+                              4: date.today()}, self.modified())
+
+    def testWritesChanged(self):
+        self.update(FullCitationStream(range(1, 4)))
+        self.age()
+        stream = list(FullCitationStream(range(1, 4)))
+        stream[1].copyright = 'changed'  # the abstract of PMID 1
+        stream[-15].revised = date.today()  # the citation of PMID 3
+        loader = self.update(stream)
+        self.assertEqual(1, loader.skipped)
+        self.assertDictEqual({1: date.today(), 2: self.yesterday, 3: date.today()},
+                             self.modified())
+
+    def testWritesChangedRowsOnly(self):
+        self.update(FullCitationStream(range(1, 3)))
+        self.age()
+        stream = list(FullCitationStream(range(1, 3)))
+        del stream[6]  # qualifier 1:1 of PMID 1
+        stream[4].name = 'changed'  # descriptor 1:1
+        stream.append(Author(1, 3, 'added'))
+        loader = self.update(stream)
+        counts = loader.counts
+        self.assertEqual(1, loader.skipped)
+        self.assertEqual(1, counts['citations']['updated'])  # modified
+        self.assertEqual(1, counts['descriptors']['updated'])
+        self.assertEqual(1, counts['descriptors']['unchanged'])
+        self.assertEqual(1, counts['qualifiers']['deleted'])
+        self.assertEqual(1, counts['authors']['inserted'])
+        self.assertEqual(2, counts['authors']['unchanged'])
+        self.assertEqual(1, counts['fingerprints']['updated'])
+        self.assertEqual(0, sum(counts['sections'][k] for k in
+                                ('inserted', 'updated', 'deleted')))
+        self.assertEqual(['changed', 'd_name'],
+                         [d.name for d in self.sess.query(Descriptor).filter_by(pmid=1)])
+        self.assertEqual(1, self.sess.query(Qualifier).count())
+        self.assertEqual(5, self.sess.query(Author).count())
+        self.assertDictEqual({1: date.today(), 2: self.yesterday}, self.modified())
+
+    def testMissingFingerprintKeepsModified(self):
+        self.update(FullCitationStream(range(1, 3)))
+        self.age()
+        self.sess.query(Fingerprint).delete()
+        self.sess.commit()
+        loader = self.update(FullCitationStream(range(1, 3)))
+        self.assertEqual(0, loader.counts['citations']['updated'])
+        self.assertEqual(2, loader.counts['fingerprints']['inserted'])
+        self.assertEqual(2, self.sess.query(Fingerprint).count())
+        self.assertDictEqual({1: self.yesterday, 2: self.yesterday}, self.modified())
+
+    def testMissingFingerprintWritesChanged(self):
+        self.update(FullCitationStream(range(1, 3)))
+        self.age()
+        self.sess.query(Fingerprint).delete()
+        self.sess.commit()
+        stream = list(FullCitationStream(range(1, 3)))
+        stream[4].name = 'changed'  # descriptor 1:1
+        loader = self.update(stream)
+        self.assertEqual(1, loader.counts['citations']['updated'])
+        self.assertDictEqual({1: date.today(), 2: self.yesterday}, self.modified())
+
+    def testComputeIgnoresOrderAndModified(self):
+        instances = list(FullCitationStream([1]))
+        digest = Fingerprint.compute(instances)
+        instances[0].modified = self.yesterday
+        self.assertEqual(digest, Fingerprint.compute(reversed(instances)))
+
+
+def UpdateXML(titles, deleted=()):
+    """Return a minimal MEDLINE XML update file for a dict of PMIDs to titles."""
+    citation = """<MedlineCitation Status="MEDLINE"><PMID>{}</PMID>
+<DateCreated><Year>1990</Year><Month>01</Month><Day>01</Day></DateCreated>
+<Article><Journal><JournalIssue><PubDate><Year>1990</Year></PubDate></JournalIssue></Journal>
+<ArticleTitle>{}</ArticleTitle></Article>
+<MedlineJournalInfo><MedlineTA>journal</MedlineTA></MedlineJournalInfo>
+</MedlineCitation>"""
+    xml = ['<MedlineCitationSet>']
+    xml.extend(citation.format(pmid, title) for pmid, title in sorted(titles.items()))
+
+    if deleted:
+        xml.append('<DeleteCitation>')
+        xml.extend('<PMID>{}</PMID>'.format(pmid) for pmid in deleted)
+        xml.append('</DeleteCitation>')
+
+    xml.append('</MedlineCitationSet>')
+    return '\n'.join(xml)
+
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        self.dir = TemporaryDirectory()
+        self.write('n0001.xml', UpdateXML({1: 'one', 2: 'two', 3: 'three'}))
+        self.write('n0002.xml', UpdateXML({2: 'new two'}, [1]))
+        self.write('n0003.xml', UpdateXML({4: 'four'}))
+        self.write('README.txt', 'not an update file')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, content):
+        with open(join(self.dir.name, name), 'wt') as f:
+            f.write(content)
+
+    def titles(self):
+        self.sess.expire_all()
+        return dict(self.sess.query(Citation.pmid, Citation.title))
+
+    def testSyncInOrder(self):
+        self.assertTrue(sync(self.sess, self.dir.name, True, 2))
+        self.assertDictEqual({2: 'new two', 3: 'three', 4: 'four'}, self.titles())
+        files = {f.name: (f.citations, f.deletions) for f in self.sess.query(UpdateFile)}
+        self.assertDictEqual({'n0001.xml': (3, 0), 'n0002.xml': (1, 1),
+                              'n0003.xml': (1, 0)}, files)
+
+    def testSyncIsIdempotent(self):
+        self.assertTrue(sync(self.sess, self.dir.name, True, 1))
+        self.sess.query(Citation).filter_by(pmid=3).update({'title': 'local'})
+        self.sess.commit()
+        self.write('n0004.xml', UpdateXML({5: 'five'}))
+        self.assertTrue(sync(self.sess, self.dir.name, True, 1))
+        self.assertDictEqual({2: 'new two', 3: 'local', 4: 'four', 5: 'five'}, self.titles())
+        self.assertEqual(4, self.sess.query(UpdateFile).count())
+
+
+class TestParallelUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.url = 'sqlite+pysqlite:///' + join(self.dir.name, 'medline.db')
+        self.file = join(self.dir.name, 'update.xml')
+        InitDb(self.url)
+
+        with open(self.file, 'wt') as f:
+            f.write(UpdateXML({pmid: str(pmid) for pmid in range(1, 7)}))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def titles(self):
+        return dict(Session().query(Citation.pmid, Citation.title))
+
+    def testWorkerUpdatesPartition(self):
+        queue, results = Queue(), Queue()
+
+        for citation in _collectCitation(FullCitationStream([2, 4])):
+            queue.put(citation)
+
+        queue.put(None)
+        _updateWorker(self.url, 0, queue, results, 1)
+        self.assertEqual((0, True, 2, 0, None), results.get_nowait())
+        self.assertDictEqual({2: 'title', 4: 'title'}, self.titles())
+        self.assertEqual(2, Session().query(Fingerprint).count())
+
+    def testWorkerReportsFailure(self):
+        queue, results = Queue(), Queue()
+        queue.put([Author(9, 1, 'orphan')])  # violates the citation FK
+        queue.put(None)
+        _updateWorker(self.url, 1, queue, results, 0)
+        partition, success, count, _, error = results.get_nowait()
+        self.assertEqual((1, False, 0), (partition, success, count))
+        self.assertTrue(error)
+
+    def testUpdatePartitions(self):
+        self.assertTrue(_updatePartitions(self.url, [self.file], True, 0, 2))
+        self.assertDictEqual({pmid: str(pmid) for pmid in range(1, 7)}, self.titles())
+
+    def testWorkerDeletesAtEndOfFile(self):
+        queue, results = Queue(), Queue()
+
+        for citation in _collectCitation(FullCitationStream([2, 4])):
+            queue.put(citation)
+
+        queue.put(2)
+        queue.put(END_OF_FILE)
+
+        for citation in _collectCitation(FullCitationStream([2])):
+            queue.put(citation)
+
+        queue.put(None)
+        _updateWorker(self.url, 0, queue, results, 0)
+        self.assertTrue(results.get_nowait()[1])
+        self.assertDictEqual({2: 'title', 4: 'title'}, self.titles())
+
+    def testUpdatePartitionsAddsDeletedAgain(self):
+        n1, n2 = join(self.dir.name, 'n0001.xml'), join(self.dir.name, 'n0002.xml')
+
+        with open(n1, 'wt') as f:
+            f.write(UpdateXML({1: 'one', 2: 'two'}, [2]))
+
+        with open(n2, 'wt') as f:
+            f.write(UpdateXML({2: 'new two'}))
+
+        # one partition at a time, as SQLite does not support concurrent writers
+        self.assertTrue(_updatePartitions(self.url, [n1, n2], True, 0, 2, [0]))
+        self.assertTrue(_updatePartitions(self.url, [n1, n2], True, 0, 2, [1]))
+        self.assertDictEqual({1: 'one', 2: 'new two'}, self.titles())
+
+    def testUpdateSelectedPartition(self):
+        self.assertTrue(_updatePartitions(self.url, [self.file], True, 0, 2, [1]))
+        self.assertDictEqual({1: '1', 3: '3', 5: '5'}, self.titles())
+
+    def testRejectUnknownPartition(self):
+        self.assertFalse(_updatePartitions(self.url, [self.file], True, 0, 2, [2]))
+
+    def testSQLiteUpdatesInOneProcess(self):
+        with self.assertLogs('medic.crud', 'WARNING'):
+            self.assertTrue(update(Session(), [self.file], True, workers=2))
+
+        self.assertEqual(6, len(self.titles()))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,60 @@
+import json
+import unittest
+
+from datetime import date
+from sqlite3 import dbapi2
+
+from medic.crud import _CoreLoader, _streamInstances, select, WRITE_RELATIONS
+from medic.jsonl import AsDict, FormatJSON
+from medic.orm import InitDb, Session
+from medic.reader import read
+from medic.test.crud_test import FullCitationStream, URI
+
+
+class TestJSON(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _CoreLoader(self.sess)
+        _streamInstances(self.sess, loader, FullCitationStream(range(1, 4)))
+        loader.commit()
+
+    def records(self):
+        return select(self.sess, [1, 2, 3], WRITE_RELATIONS['jsonl'])
+
+    def testAsDict(self):
+        data = AsDict(next(self.records()))
+        self.assertEqual(1, data['pmid'])
+        self.assertEqual('title', data['title'])
+        self.assertEqual('2000-01-01', data['revised'])
+        self.assertEqual(date.today().isoformat(), data['created'])
+        self.assertListEqual(['NLM'], list(data['abstracts']))
+        self.assertEqual('copyright', data['abstracts']['NLM']['copyright'])
+        self.assertDictEqual({'seq': 1, 'name': 'Background', 'label': 'BG',
+                              'content': 'The Abstract 1', 'truncated': False},
+                             data['abstracts']['NLM']['sections'][0])
+        self.assertListEqual(['first', 'last'], [a['name'] for a in data['authors']])
+        self.assertDictEqual({'sub': 1, 'major': True, 'name': 'q_name'},
+                             data['descriptors'][0]['qualifiers'][0])
+        self.assertListEqual([], data['descriptors'][1]['qualifiers'])
+        self.assertDictEqual({'doi': 'id/1'}, data['identifiers'])
+        self.assertListEqual(['some'], data['publication_types'])
+        self.assertEqual('NOTNLM', data['keywords'][0]['owner'])
+        self.assertEqual('uid', data['chemicals'][0]['uid'])
+        self.assertEqual('accession', data['databases'][0]['accession'])
+
+    def testFormatJSON(self):
+        for record in self.records():
+            line = FormatJSON(record)
+            self.assertNotIn('\n', line)
+            self.assertNotIn(', ', line)
+            self.assertDictEqual(AsDict(record), json.loads(line))
+
+    def testSameAsReader(self):
+        self.assertListEqual([FormatJSON(r) for r in self.records()],
+                             [FormatJSON(r) for r in read(self.sess, [1, 2, 3])])
+
+
+if __name__ == '__main__':
+    unittest.main()
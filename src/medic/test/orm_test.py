@@ -6,8 +6,10 @@ from unittest import main, TestCase
 
 from sqlalchemy.exc import IntegrityError, StatementError
 
+from medic import orm
 from medic.orm import InitDb, Session, Citation, Section, Author, Descriptor, Qualifier, \
-    Database, Identifier, Chemical, Keyword, PublicationType, Abstract
+    Database, Identifier, Chemical, Keyword, PublicationType, Abstract, Fingerprint, \
+    Statistic
 
 __author__ = 'Florian Leitner'
 
@@ -217,7 +219,10 @@ class CitationTest(TestCase, TestMixin):
                 dict(pmid=1, idx=1, name='name')
             ],
             Keyword.__tablename__: [
-                dict(pmid=1, owner='NLM', cnt=1, major=True, value='name')
+                dict(pmid=1, owner='NLM', cnt=1, major=True, name='name')
+            ],
+            PublicationType.__tablename__: [
+                dict(pmid=1, value='type')
             ],
         }
         Citation.insert(data)
@@ -287,6 +292,54 @@ class CitationTest(TestCase, TestMixin):
         self.addThree(date.today())
         self.assertListEqual([1, 3], list(Citation.existing([1, 3, 5])))
 
+    def addMany(self, n):
+        data = {Citation.__tablename__: [
+            dict(pmid=i, status='MEDLINE', year=1990, title='Title', journal='Journal',
+                 pub_date='1990 PubDate', created=date.today(), modified=date.today())
+            for i in range(1, n + 1)
+        ]}
+        Citation.insert(data)
+
+    def testExistingInChunks(self):
+        self.addMany(2000)
+        pmids = list(range(1000, 3001))
+        self.assertSetEqual(set(range(1000, 2001)), Citation.existing(pmids + pmids))
+        self.assertSetEqual(set(range(2001, 3001)), Citation.missing(pmids))
+
+    def testListRelationsOrderedByPrimaryKey(self):
+        # the same order as the rows of medic.reader
+        for name in ('authors', 'chemicals', 'databases', 'descriptors', 'keywords',
+                     'publication_types'):
+            relation = Citation.__mapper__.relationships[name]
+            columns = relation.mapper.local_table.primary_key.columns
+            self.assertListEqual([c.key for c in columns if c.key != 'pmid'],
+                                 [c.key for c in relation.order_by], name)
+
+    def testInLimit(self):
+        c = Citation.__table__.c
+        self.assertEqual(orm.QUERY_LIMIT, orm.InLimit())
+        self.assertEqual(orm.QUERY_LIMIT - 3, orm.InLimit([c.year.between(1990, 2000),
+                                                           c.journal == 'Journal']))
+
+    def testExistingWithTempTable(self):
+        threshold = orm.TEMP_TABLE_THRESHOLD
+        orm.TEMP_TABLE_THRESHOLD = 1000
+
+        try:
+            self.addMany(2000)
+            pmids = list(range(1000, 3001))
+            self.assertSetEqual(set(range(1000, 2001)), Citation.existing(pmids))
+            self.assertSetEqual(set(), Citation.modifiedBefore(pmids, date.today()))
+            self.assertEqual(1001, len(Citation.select(pmids, ['title'])))
+        finally:
+            orm.TEMP_TABLE_THRESHOLD = threshold
+
+    def testSelectReturnsLists(self):
+        self.addThree(date.today())
+        rows = Citation.selectAll([1, 2, 3])
+        self.assertEqual([1, 2, 3], sorted(row['pmid'] for row in rows))
+        self.assertEqual([], Citation.select([], ['title']))
+
 
 class SectionTest(TestCase, TestMixin):
     def setUp(self):
@@ -762,6 +815,13 @@ class IdentifierTest(TestCase, TestMixin):
                              Identifier.mapDois2Pmids(['id1', 'id2', 'id3']))
         self.assertDictEqual({}, Identifier.mapDois2Pmids(['id3', 'id4']))
 
+    def testMapManyDois2Pmids(self):
+        self.sess.add(Identifier(1, 'doi', 'id1'))
+        self.sess.commit()
+        dois = ['id{}'.format(i) for i in range(1500)]
+        self.assertDictEqual({'id1': 1}, Identifier.mapDois2Pmids(dois))
+        self.assertDictEqual({1: 'id1'}, Identifier.mapPmids2Dois(range(1, 1500)))
+
 
 class PublicationTypeTest(TestCase, TestMixin):
     def setUp(self):
@@ -809,6 +869,47 @@ class PublicationTypeTest(TestCase, TestMixin):
         self.assertEqual(self.M, i.citation)
 
 
+class FingerprintTest(TestCase, TestMixin):
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        self.M = DefaultCitation()
+        self.sess.add(self.M)
+        self.klass = Fingerprint
+        self.entity = namedtuple('Fingerprint', 'pmid digest')
+        self.defaults = self.entity(1, 'digest')
+
+    def testCreate(self):
+        self.assertCreate()
+
+    def testEquals(self):
+        self.assertSame()
+        self.assertDifference(digest='other')
+
+    def testRequireNonEmptyDigest(self):
+        self.assertNonEmptyValue(AssertionError, 'digest')
+
+    def testToString(self):
+        self.assertEqual('1\tdigest\n', str(Fingerprint(1, 'digest')))
+
+    def testToRepr(self):
+        self.assertEqual('Fingerprint<1>', repr(Fingerprint(1, 'digest')))
+
+    def testCompute(self):
+        a = Fingerprint.compute([DefaultCitation(), Author(1, 1, 'name')])
+        b = Fingerprint.compute([Author(1, 1, 'name'), DefaultCitation()])
+        c = Fingerprint.compute([DefaultCitation(), Author(1, 1, 'other')])
+        self.assertEqual(40, len(a))
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+    def testCascadeDelete(self):
+        self.sess.add(Fingerprint(1, 'digest'))
+        self.sess.commit()
+        Citation.delete([1])
+        self.assertEqual(0, self.sess.query(Fingerprint).count())
+
+
 class DatabaseTest(TestCase, TestMixin):
     def setUp(self):
         InitDb(URI, module=dbapi2)
@@ -999,5 +1100,45 @@ class KeywordTest(TestCase, TestMixin):
         self.assertEqual(self.M, i.citation)
 
 
+class StatisticTest(TestCase, TestMixin):
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        self.klass = Statistic
+        self.entity = namedtuple('Statistic', 'name key count')
+        self.defaults = self.entity('citations', Statistic.TOTAL, 1)
+
+    def testCreate(self):
+        self.assertCreate()
+
+    def testEquals(self):
+        self.assertSame()
+        self.assertDifference(key='year:1990')
+        self.assertDifference(count=2)
+
+    def testToRepr(self):
+        self.assertEqual('Statistic<citations:year:1990>',
+                         repr(Statistic('citations', 'year:1990', 1)))
+
+    def testIncrement(self):
+        conn = self.sess.connection()
+        Statistic.increment(conn, {('citations', ''): 2, ('authors', ''): 0})
+        Statistic.increment(conn, {('citations', ''): -1, ('citations', 'year:1990'): 1})
+        self.sess.commit()
+        self.assertListEqual([Statistic('citations', '', 1), Statistic('citations', 'year:1990', 1)],
+                             list(self.sess.query(Statistic).order_by(Statistic.key)))
+
+    def testInsertIncrementsInTransaction(self):
+        row = dict(pmid=1, status='MEDLINE', year=1990, title='Title', journal='Journal',
+                   pub_date='1990 PubDate', created=date.today(), modified=date.today())
+        deltas = {('citations', ''): 1}
+        Citation.insert({'citations': [row]}, deltas)
+
+        with self.assertRaises(IntegrityError):
+            Citation.insert({'citations': [row]}, deltas)
+
+        self.assertListEqual([Statistic('citations', '', 1)], list(self.sess.query(Statistic)))
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,119 @@
+import sys
+import unittest
+
+from array import array
+from io import StringIO
+from os.path import join
+from sqlite3 import dbapi2
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from medic import pmids
+from medic.crud import _CoreLoader, _streamInstances, select, delete, partition
+from medic.orm import InitDb, Session, Citation, Section
+from medic.pmids import PmidArray, AsPmids, ReadPmids, LoadPmids, WritePmids, IsBinary, \
+    MAGIC, TYPECODE
+from medic.reader import read
+from medic.test.crud_test import FullCitationStream, URI
+
+
+class TestPmidArray(unittest.TestCase):
+
+    def testSortedInput(self):
+        values = PmidArray([1, 2, 2, 5])
+        self.assertEqual(array(TYPECODE, [1, 2, 5]), values)
+
+    def testUnsortedInput(self):
+        with patch.object(pmids, 'SORT_SIZE', 3):
+            values = PmidArray([9, 3, 7, 3, 1, 9, 8, 2])
+
+        self.assertEqual(array(TYPECODE, [1, 2, 3, 7, 8, 9]), values)
+
+    def testAsPmids(self):
+        self.assertEqual(array(TYPECODE, [1, 3]), AsPmids(['3', '1']))
+        values = PmidArray([4, 2])
+        self.assertIs(values, AsPmids(values))
+
+
+class TestReadPmids(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.text = join(self.dir.name, 'pmids.txt')
+        self.binary = join(self.dir.name, 'pmids.bin')
+
+        with open(self.text, 'w') as file:
+            file.write('5\n3\n\n 7 \n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testReadText(self):
+        self.assertEqual(array(TYPECODE, [2, 3, 5, 7]), ReadPmids([self.text, '2', '5']))
+
+    def testReadStdin(self):
+        with patch.object(sys, 'stdin', StringIO('4\n1\n')):
+            self.assertEqual(array(TYPECODE, [1, 4, 9]), ReadPmids(['-', '9']))
+
+    def testRejectsText(self):
+        self.assertRaises(ValueError, ReadPmids, ['ALL'])
+
+    def testBinaryRoundTrip(self):
+        self.assertEqual(3, WritePmids(self.binary, [7, 1, 3, 3]))
+        self.assertTrue(IsBinary(self.binary))
+        self.assertFalse(IsBinary(self.text))
+
+        with open(self.binary, 'rb') as file:
+            self.assertEqual(MAGIC, file.read(len(MAGIC)))
+
+        values = ReadPmids([self.binary])
+        self.assertIsInstance(values, memoryview)
+        self.assertListEqual([1, 3, 7], list(values))
+        self.assertListEqual([3], list(values[1:2]))
+        self.assertEqual(array(TYPECODE, [1, 3, 5, 7]), ReadPmids([self.binary, self.text]))
+        values.release()
+
+    def testEmptyBinary(self):
+        WritePmids(self.binary, [])
+        self.assertEqual(0, len(LoadPmids(self.binary)))
+
+    def testRejectsTruncatedBinary(self):
+        with open(self.binary, 'wb') as file:
+            file.write(MAGIC + b'\x01\x02')
+
+        self.assertRaises(ValueError, LoadPmids, self.binary)
+
+
+class TestPmidSequences(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _CoreLoader(self.sess)
+        _streamInstances(self.sess, loader, FullCitationStream(range(1, 1201)))
+        loader.commit()
+        self.pmids = PmidArray(range(2, 1202, 2))
+
+    def testSelect(self):
+        records = select(self.sess, self.pmids)
+        self.assertListEqual(list(range(2, 1201, 2)), sorted(r.pmid for r in records))
+
+    def testRead(self):
+        records = read(self.sess, memoryview(self.pmids), bounds=(10, 20))
+        self.assertListEqual([10, 12, 14, 16, 18, 20], [r.pmid for r in records])
+
+    def testPartition(self):
+        parts = partition(self.sess, self.pmids, 4)
+        self.assertEqual(4, len(parts))
+        self.assertListEqual(list(self.pmids), [pmid for part in parts for pmid in part])
+
+    def testDelete(self):
+        self.assertTrue(delete(self.sess, self.pmids))
+        self.assertEqual(600, self.sess.query(Citation).count())
+        self.assertEqual(1200, self.sess.query(Section).count())
+        self.assertTrue(delete(self.sess, array(TYPECODE)))
+        self.assertEqual(0, self.sess.query(Citation).count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from sqlite3 import dbapi2
+
+from medic.crud import _CoreLoader, _streamInstances, select, WRITE_RELATIONS
+from medic.orm import InitDb, Session
+from medic.reader import read, Record, AuthorRow, _mergeJoin
+from medic.test.crud_test import FullCitationStream, URI
+from medic.web import FormatHTML
+
+
+class TestReader(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _CoreLoader(self.sess)
+        _streamInstances(self.sess, loader, FullCitationStream(range(1, 21)))
+        loader.commit()
+
+    def testRecords(self):
+        records = list(read(self.sess, [3, 1, 99, 1]))
+        self.assertListEqual([1, 3], [r.pmid for r in records])
+        record = records[0]
+        self.assertEqual('title', record.title)
+        self.assertEqual('1990 pub_date; 1(2)', record.citation())
+        self.assertListEqual([1, 2], [s.seq for s in record.abstracts['NLM'].sections])
+        self.assertListEqual(['Fore first', 'last'], [a.fullName() for a in record.authors])
+        self.assertListEqual([1, 2], [d.num for d in record.descriptors])
+        self.assertListEqual([1], [q.sub for q in record.descriptors[0].qualifiers])
+        self.assertListEqual([], record.descriptors[1].qualifiers)
+        self.assertEqual('id/1', record.identifiers['doi'].value)
+        self.assertListEqual(['some'], [p.value for p in record.publication_types])
+
+    def testReadAll(self):
+        self.assertListEqual(list(range(1, 21)),
+                             [r.pmid for r in read(self.sess, [], batch_size=7)])
+
+    def testReadBounds(self):
+        self.assertListEqual([5, 6, 7], [r.pmid for r in read(self.sess, [], 2, (5, 7))])
+        self.assertListEqual([7], [r.pmid for r in read(self.sess, [1, 7, 9], bounds=(5, 8))])
+
+    def testSameHTMLAsORM(self):
+        orm = FormatHTML(select(self.sess, list(range(1, 21)), WRITE_RELATIONS['html']))
+        self.assertEqual(orm, FormatHTML(read(self.sess, list(range(1, 21)))))
+
+    def testSlotted(self):
+        record = next(read(self.sess, [1]))
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual('Citation<1>', repr(record))
+
+    def testMergeJoin(self):
+        records = [Record([pmid]) for pmid in (2, 4, 6)]
+        rows = [AuthorRow([pmid, 1, 'name']) for pmid in (1, 2, 2, 5, 6, 7)]
+        _mergeJoin(records, rows, lambda record, row: record.authors.append(row))
+        self.assertListEqual([2, 0, 1], [len(r.authors) for r in records])
+
+
+if __name__ == '__main__':
+    unittest.main()
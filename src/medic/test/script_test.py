@@ -0,0 +1,72 @@
+import pickle
+import unittest
+
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
+from os.path import dirname, join
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from medic.crud import _CoreLoader, _streamInstances
+from medic.orm import InitDb, Session
+from medic.pmids import LoadPmids, WritePmids
+from medic.test.crud_test import FullCitationStream
+
+SCRIPT = join(dirname(__file__), '..', '..', '..', 'scripts', 'medic')
+
+
+def LoadScript():
+    loader = SourceFileLoader('medic_script', SCRIPT)
+    module = module_from_spec(spec_from_loader(loader.name, loader))
+    loader.exec_module(module)
+    return module
+
+
+class PickledProcess:
+    """Run the target in this process, but with pickled arguments (as with spawn)."""
+
+    def __init__(self, target, name, args):
+        self.target = target
+        self.name = name
+        self.args = pickle.dumps(args)
+        self.exitcode = None
+
+    def start(self):
+        self.target(*pickle.loads(self.args))
+        self.exitcode = 0
+
+    def join(self):
+        pass
+
+
+class TestWriteJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        InitDb('sqlite+pysqlite:///' + join(self.dir.name, 'medline.db'))
+        session = Session()
+        loader = _CoreLoader(session)
+        _streamInstances(session, loader, FullCitationStream(range(1, 7)))
+        loader.commit()
+        self.script = LoadScript()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testMappedPmidList(self):
+        path = join(self.dir.name, 'pmids.bin')
+        output = join(self.dir.name, 'output.tsv')
+        WritePmids(path, [2, 3, 5, 6])
+        pmids = LoadPmids(path)
+        self.assertIsInstance(pmids, memoryview)
+
+        with patch('multiprocessing.Process', PickledProcess):
+            self.assertTrue(self.script.WriteJobs(Session(), pmids, 2, 'orm', 'tsv', output))
+
+        with open(output) as file:
+            self.assertListEqual(['2', '3', '5', '6'],
+                                 [line.split('\t', 1)[0] for line in file])
+
+
+if __name__ == '__main__':
+    unittest.main()
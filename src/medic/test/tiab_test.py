@@ -0,0 +1,111 @@
+import tarfile
+import unittest
+import zipfile
+
+from os import listdir
+from os.path import join
+from sqlite3 import dbapi2
+from tempfile import TemporaryDirectory
+
+from medic.crud import _Loader, _streamInstances, select, tiab, WRITE_RELATIONS
+from medic.orm import InitDb, Session
+from medic.test.crud_test import TextCitationStream, URI
+from medic.tiab import FormatTIAB, ShardPath, OpenSink, Corpus, IndexPath, INDEX_ENTRY
+
+TEXTS = [(3, 'three\n'), (1, 'one\n\nÄbstract\n'), (2, 'two\n')]
+
+
+class TestFormat(unittest.TestCase):
+
+    def testSameAsDatabaseText(self):
+        InitDb(URI, module=dbapi2)
+        sess = Session()
+        loader = _Loader(sess, sess.add)
+        _streamInstances(sess, loader, TextCitationStream())
+        loader.commit()
+        texts = dict(tiab(sess, []))
+        records = select(sess, [], WRITE_RELATIONS['tiab'])
+        self.assertDictEqual(texts, {rec.pmid: FormatTIAB(rec) for rec in records})
+
+    def testShardPath(self):
+        self.assertEqual(ShardPath(12345), ShardPath(12345))
+        directory, name = ShardPath(12345).rsplit('/', 1)
+        self.assertEqual('12345.txt', name)
+        self.assertRegex(directory, '^[0-9a-f]{2}/[0-9a-f]{2}$')
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, output):
+        with OpenSink(name, output) as sink:
+            for pmid, text in TEXTS:
+                sink.add(pmid, text)
+
+        self.assertEqual(3, sink.count)
+
+    def testFiles(self):
+        self.write('files', self.dir.name)
+        self.assertListEqual(['1.txt', '2.txt', '3.txt'], sorted(listdir(self.dir.name)))
+
+        with open(join(self.dir.name, '1.txt'), encoding='utf-8') as file:
+            self.assertEqual(TEXTS[1][1], file.read())
+
+    def testShards(self):
+        self.write('shards', self.dir.name)
+
+        with open(join(self.dir.name, ShardPath(3)), encoding='utf-8') as file:
+            self.assertEqual('three\n', file.read())
+
+    def testTar(self):
+        path = join(self.dir.name, 'tiab.tar.gz')
+        self.write('tar', path)
+
+        with tarfile.open(path) as archive:
+            self.assertListEqual(['3.txt', '1.txt', '2.txt'], archive.getnames())
+            self.assertEqual(TEXTS[1][1].encode('utf-8'), archive.extractfile('1.txt').read())
+
+    def testZip(self):
+        path = join(self.dir.name, 'tiab.zip')
+        self.write('zip', path)
+
+        with zipfile.ZipFile(path) as archive:
+            self.assertListEqual(['3.txt', '1.txt', '2.txt'], archive.namelist())
+            self.assertEqual(b'two\n', archive.read('2.txt'))
+
+    def testCorpus(self):
+        path = join(self.dir.name, 'tiab.txt')
+        self.write('corpus', path)
+
+        with open(IndexPath(path), 'rb') as file:
+            self.assertListEqual([1, 2, 3], [e[0] for e in INDEX_ENTRY.iter_unpack(file.read())])
+
+        with Corpus(path) as corpus:
+            self.assertEqual(3, len(corpus))
+            self.assertListEqual([1, 2, 3], list(corpus.pmids()))
+
+            for pmid, text in TEXTS:
+                self.assertEqual(text, corpus.get(pmid))
+
+            self.assertIsNone(corpus.get(4))
+            self.assertNotIn(0, corpus)
+
+    def testEmptyCorpus(self):
+        path = join(self.dir.name, 'tiab.txt')
+        OpenSink('corpus', path).close()
+
+        with Corpus(path) as corpus:
+            self.assertEqual(0, len(corpus))
+            self.assertIsNone(corpus.get(1))
+
+    def testUnknownSink(self):
+        self.assertRaises(ValueError, OpenSink, 'other', self.dir.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
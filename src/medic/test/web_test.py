@@ -0,0 +1,44 @@
+import unittest
+
+from sqlite3 import dbapi2
+
+from medic.crud import _CoreLoader, _streamInstances, select, WRITE_RELATIONS
+from medic.orm import InitDb, Session
+from medic.test.crud_test import FullCitationStream, URI
+from medic.web import FormatHTML, FormatIndex, StreamHTML, HTML_HEADER, HTML_FOOTER
+
+
+class TestHTML(unittest.TestCase):
+
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        loader = _CoreLoader(self.sess)
+        _streamInstances(self.sess, loader, FullCitationStream(range(1, 4)))
+        loader.commit()
+
+    def records(self):
+        return select(self.sess, [1, 2, 3], WRITE_RELATIONS['html'])
+
+    def testStreamsArticles(self):
+        pieces = list(StreamHTML(self.records()))
+        self.assertEqual(5, len(pieces))
+        self.assertEqual(HTML_HEADER, pieces[0])
+        self.assertTrue(pieces[1].startswith('<article id=1>'))
+        self.assertTrue(pieces[3].endswith('</article><hr/>'))
+        self.assertEqual(HTML_FOOTER, pieces[-1])
+
+    def testFormatHTML(self):
+        self.assertEqual(''.join(StreamHTML(self.records())), FormatHTML(self.records()))
+
+    def testEmpty(self):
+        self.assertEqual(HTML_HEADER + HTML_FOOTER, FormatHTML([]))
+
+    def testFormatIndex(self):
+        index = FormatIndex([('a-1.html', 1, 10, 3), ('a-2.html', 12, 20, 2)])
+        self.assertIn('<li><a href="a-1.html">PMID 1 - 10</a> (3 articles)</li>', index)
+        self.assertIn('<li><a href="a-2.html">PMID 12 - 20</a> (2 articles)</li>', index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+"""
+.. py:module:: medic.tiab
+   :synopsis: Sinks for title/abstract (TIAB) plain-text output.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+"""
+import logging
+import os
+import struct
+import sys
+import tarfile
+import zipfile
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from io import BytesIO
+from mmap import mmap, ACCESS_READ
+from time import time
+from zlib import crc32
+
+logger = logging.getLogger(__name__)
+
+SINKS = ('files', 'shards', 'tar', 'zip', 'corpus')
+"The names of the TIAB sinks (see `OpenSink`)."
+
+INDEX_ENTRY = struct.Struct('<qQI')
+"A corpus index entry: the PMID, and the byte offset and length of its text."
+
+
+def FormatTIAB(record) -> str:
+    """
+    Format the title and the sections of the NLM abstract (or the only
+    abstract) of a `record` as TIAB plain-text: the title line, followed by
+    each section as an empty line, its label line (if any), and its content.
+    """
+    lines = [record.title]
+
+    if 'NLM' in record.abstracts:
+        sections = record.abstracts['NLM'].sections
+    elif len(record.abstracts) == 1:
+        sections = next(iter(record.abstracts.values())).sections
+    else:
+        sections = []
+
+    for section in sections:
+        lines.append('')
+
+        if section.label is not None:
+            lines.append(section.label)
+
+        lines.append(section.content)
+
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def ShardPath(pmid: int) -> str:
+    """
+    Return the relative path of a PMID's file in a sharded directory:
+    two levels of 256 subdirectories, from the CRC-32 hash of the PMID.
+    """
+    digest = crc32(str(pmid).encode('ascii'))
+    return os.path.join('{:02x}'.format(digest & 0xff), '{:02x}'.format(digest >> 8 & 0xff),
+                        '{}.txt'.format(pmid))
+
+
+def OpenSink(name: str, output: str):
+    """
+    Return the TIAB sink with that `name` (see `SINKS`) for the `output`
+    directory (files, shards) or file (tar, zip, corpus; or STDOUT if
+    ``output == '.'``\\ , for tar and zip archives).
+    """
+    if name == 'files':
+        return FileSink(output)
+    elif name == 'shards':
+        return ShardSink(output)
+    elif name == 'tar':
+        return TarSink(output)
+    elif name == 'zip':
+        return ZipSink(output)
+    elif name == 'corpus':
+        return CorpusSink(output)
+    else:
+        raise ValueError('unknown TIAB sink "{}"'.format(name))
+
+
+class Sink(ABC):
+    """
+    Base class of all TIAB sinks, which are context managers that `add`
+    one text per PMID and are closed at the end.
+    """
+
+    def __init__(self, output: str):
+        self.output = output
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def add(self, pmid: int, text: str):
+        """Add the TIAB `text` of a PMID."""
+        logger.debug("writing PMID %i as TIAB", pmid)
+        self.write(pmid, text.encode('utf-8'))
+        self.count += 1
+
+    @abstractmethod
+    def write(self, pmid: int, data: bytes):
+        """Write the encoded TIAB `data` of a PMID."""
+
+    def close(self):
+        logger.info("wrote %i TIAB texts to %s", self.count, self.output)
+
+
+class FileSink(Sink):
+    """Write each text to its own ``<pmid>.txt`` file in the `output` directory."""
+
+    def __init__(self, output: str):
+        assert os.path.isdir(output), '%s not a directory' % output
+        super(FileSink, self).__init__(output)
+
+    def path(self, pmid: int) -> str:
+        return os.path.join(self.output, '{}.txt'.format(pmid))
+
+    def write(self, pmid: int, data: bytes):
+        with open(self.path(pmid), 'wb') as file:
+            file.write(data)
+
+
+class ShardSink(FileSink):
+    """Write each text to its own file in hash-sharded subdirectories (see `ShardPath`)."""
+
+    def path(self, pmid: int) -> str:
+        path = os.path.join(self.output, ShardPath(pmid))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+
+class TarSink(Sink):
+    """
+    Stream each text as a ``<pmid>.txt`` member to a tar archive (to
+    STDOUT if ``output == '.'``\\ ), compressed if the `output` ends with
+    ".gz" or ".tgz".
+    """
+
+    def __init__(self, output: str):
+        super(TarSink, self).__init__(output)
+        compressed = output.endswith('.gz') or output.endswith('.tgz')
+        fileobj = sys.stdout.buffer if output == '.' else None
+        self.archive = tarfile.open(None if output == '.' else output,
+                                    'w|gz' if compressed else 'w|', fileobj)
+        self.mtime = time()
+
+    def write(self, pmid: int, data: bytes):
+        info = tarfile.TarInfo('{}.txt'.format(pmid))
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.archive.addfile(info, BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+        super(TarSink, self).close()
+
+
+class ZipSink(Sink):
+    """Write each text as a compressed ``<pmid>.txt`` member to a zip archive."""
+
+    def __init__(self, output: str):
+        super(ZipSink, self).__init__(output)
+        self.archive = zipfile.ZipFile(sys.stdout.buffer if output == '.' else output,
+                                       'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, pmid: int, data: bytes):
+        self.archive.writestr('{}.txt'.format(pmid), data)
+
+    def close(self):
+        self.archive.close()
+        super(ZipSink, self).close()
+
+
+class CorpusSink(Sink):
+    """
+    Concatenate all texts into one corpus file and write a binary index of
+    `INDEX_ENTRY` records (sorted by PMID) to the corpus file name plus
+    ".idx" (see `Corpus`).
+    """
+
+    def __init__(self, output: str):
+        assert output != '.', 'a corpus requires an output file'
+        super(CorpusSink, self).__init__(output)
+        self.corpus = open(output, 'wb')
+        self.index = open(IndexPath(output), 'wb')
+        self.offset = 0
+        self.last = None
+        self.ordered = True
+
+    def write(self, pmid: int, data: bytes):
+        self.corpus.write(data)
+        self.index.write(INDEX_ENTRY.pack(pmid, self.offset, len(data)))
+        self.offset += len(data)
+
+        if self.last is not None and pmid <= self.last:
+            self.ordered = False
+
+        self.last = pmid
+
+    def close(self):
+        self.corpus.close()
+        self.index.close()
+
+        if not self.ordered:
+            self.sortIndex()
+
+        super(CorpusSink, self).close()
+
+    def sortIndex(self):
+        """Sort the index by PMID (e.g., if the PMIDs were not written in order)."""
+        logger.debug("sorting corpus index %s", IndexPath(self.output))
+
+        with open(IndexPath(self.output), 'rb') as file:
+            data = file.read()
+
+        entries = sorted(INDEX_ENTRY.iter_unpack(data))
+
+        with open(IndexPath(self.output), 'wb') as file:
+            for entry in entries:
+                file.write(INDEX_ENTRY.pack(*entry))
+
+
+def IndexPath(corpus: str) -> str:
+    """Return the path of the index of a `corpus` file."""
+    return corpus + '.idx'
+
+
+class Corpus:
+    """
+    Random access to the texts of a corpus file written by `CorpusSink`,
+    memory-mapping the corpus and binary-searching its index by PMID.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._files = [open(path, 'rb'), open(IndexPath(path), 'rb')]
+        self.corpus, self.index = (
+            mmap(f.fileno(), 0, access=ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+            for f in self._files
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self):
+        return len(self.index) // INDEX_ENTRY.size
+
+    def __getitem__(self, i: int) -> tuple:
+        return INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)
+
+    def __contains__(self, pmid: int) -> bool:
+        return self.find(pmid) is not None
+
+    def pmids(self) -> iter([int]):
+        """Yield all PMIDs in the corpus, in order."""
+        for i in range(len(self)):
+            yield self[i][0]
+
+    def find(self, pmid: int):
+        """Return the index entry of a PMID, or ``None`` if it is not in the corpus."""
+        i = bisect_left(_Keys(self), pmid)
+
+        if i < len(self) and self[i][0] == pmid:
+            return self[i]
+
+        return None
+
+    def get(self, pmid: int, default: str=None) -> str:
+        """Return the text of a PMID (or the `default` if it is not in the corpus)."""
+        entry = self.find(pmid)
+
+        if entry is None:
+            return default
+
+        _, offset, length = entry
+        return self.corpus[offset:offset + length].decode('utf-8')
+
+    def close(self):
+        for data in (self.corpus, self.index):
+            if isinstance(data, mmap):
+                data.close()
+
+        for file in self._files:
+            file.close()
+
+
+class _Keys:
+    """A sequence view of the PMIDs in a `Corpus` index, for `bisect_left`."""
+
+    def __init__(self, corpus: Corpus):
+        self.corpus = corpus
+
+    def __len__(self):
+        return len(self.corpus)
+
+    def __getitem__(self, i: int) -> int:
+        return self.corpus[i][0]
@@ -88,10 +88,7 @@ def Download(pmids: list, timeout: int=60) -> HTTPResponse:
     return URL_OPENER.open(url, timeout=timeout)
 
 
-def FormatHTML(query):
-    file = StringIO()
-    p = file.write
-    p("""<!doctype html>
+HTML_HEADER = """<!doctype html>
 <html><head>
   <meta charset="UTF-8"/>
   <title>PubMed Articles</title>
@@ -121,8 +118,42 @@ function toggleVisibility(pmid, target) {
     }
 }
   </script>
-</head><body>""")  # .format(file.encoding))
+</head><body>"""
+"The head of an HTML document of articles (see `StreamHTML`)."
+
+HTML_FOOTER = """  <script>
+window.onload = function() {
+    toggleAll(document.getElementsByTagName("ul"))
+    toggleAll(document.getElementsByTagName("dl"))
+}
+  </script>
+</body></html>"""
+"The end of an HTML document of articles (see `StreamHTML`)."
+
+
+def FormatHTML(query) -> str:
+    """Format the records of a `query` as one HTML document (see `StreamHTML`)."""
+    return ''.join(StreamHTML(query))
+
+
+def StreamHTML(query) -> iter([str]):
+    """
+    Yield the HTML document for the records of a `query` in pieces: the
+    `HTML_HEADER`, one article per record, and the `HTML_FOOTER`, so the
+    document can be written incrementally, in constant memory.
+    """
+    yield HTML_HEADER
+
+    for rec in query:
+        yield FormatArticle(rec)
+
+    yield HTML_FOOTER
 
+
+def FormatArticle(rec) -> str:
+    """Format a record as an HTML article."""
+    file = StringIO()
+    p = file.write
     href = lambda pmid: "{}{}".format(DATABANK_LINK['PubMed'], pmid)
     button = (
         lambda pmid, target, title:
@@ -145,145 +176,164 @@ function toggleVisibility(pmid, target) {
     #     ", revised: {}".format(rec.revised))
     formatMajor = lambda e: '<b>{}</b>'.format(e.name) if e.major else e.name
 
-    for rec in query:
-        logging.debug('writing PMID %i as HTML', rec.pmid)
-        citation = '{}, {}'.format(rec.journal, rec.citation())
-        link = None
-        pt_list = ', '.join(pt.value for pt in rec.publication_types)
-        p('<article id={}>'.format(rec.pmid))
-
-        if 'doi' in rec.identifiers:
-            link = '<a href="{}{}">'.format(
-                DATABANK_LINK['DOI'], rec.identifiers['doi'].value
-            )
-        elif 'pmc' in rec.identifiers:
-            link = '<a href="{}{}">'.format(
-                DATABANK_LINK['PMC'], rec.identifiers['pmc'].value
-            )
-
-        if link:
-            p('<p class="citation"><small>{}{}</a> '
-              '({}, PMID:{})</small></p>'.format(
-                  link, citation, pt_list, rec.pmid
-              ))
-        else:
-            p('<p class="citation"><small>{} '
-              '({}, PMID:{})</small></p>'.format(
-                  citation, pt_list, rec.pmid
-              ))
-
-        p('  <h1><a href="{}">{}</a></h1>\n  <ol>'.format(
-            href(rec.pmid), rec.title
-        ))
-
-        for author in rec.authors:
-            p('    <li>{}</li>'.format(author.fullName()))
-
-        p('  </ol>')
+    logging.debug('writing PMID %i as HTML', rec.pmid)
+    citation = '{}, {}'.format(rec.journal, rec.citation())
+    link = None
+    pt_list = ', '.join(pt.value for pt in rec.publication_types)
+    p('<article id={}>'.format(rec.pmid))
 
-        for source in rec.abstracts:
-            abstract = rec.abstracts[source]
-            p('  <h3>{} Abstract</h3>'.format(source))
-
-            for sec in abstract.sections:
-                p('  <p title="{}">{}{}</p>'.format(
-                    sec.name, "" if sec.label is None else
-                    '{}<br/>'.format(sec.label.upper()), sec.content))
+    if 'doi' in rec.identifiers:
+        link = '<a href="{}{}">'.format(
+            DATABANK_LINK['DOI'], rec.identifiers['doi'].value
+        )
+    elif 'pmc' in rec.identifiers:
+        link = '<a href="{}{}">'.format(
+            DATABANK_LINK['PMC'], rec.identifiers['pmc'].value
+        )
 
-            if abstract.copyright:
-                p('  <p title="Copyright"><small>{}</small></p>'.format(
-                    abstract.copyright
+    if link:
+        p('<p class="citation"><small>{}{}</a> '
+          '({}, PMID:{})</small></p>'.format(
+              link, citation, pt_list, rec.pmid
+          ))
+    else:
+        p('<p class="citation"><small>{} '
+          '({}, PMID:{})</small></p>'.format(
+              citation, pt_list, rec.pmid
+          ))
+
+    p('  <h1><a href="{}">{}</a></h1>\n  <ol>'.format(
+        href(rec.pmid), rec.title
+    ))
+
+    for author in rec.authors:
+        p('    <li>{}</li>'.format(author.fullName()))
+
+    p('  </ol>')
+
+    for source in rec.abstracts:
+        abstract = rec.abstracts[source]
+        p('  <h3>{} Abstract</h3>'.format(source))
+
+        for sec in abstract.sections:
+            p('  <p title="{}">{}{}</p>'.format(
+                sec.name, "" if sec.label is None else
+                '{}<br/>'.format(sec.label.upper()), sec.content))
+
+        if abstract.copyright:
+            p('  <p title="Copyright"><small>{}</small></p>'.format(
+                abstract.copyright
+            ))
+
+    p('  <div title="Metadata">')
+
+    if rec.descriptors:
+        p('    {}'.format(button(rec.pmid, "mesh", "MeSH Terms")))
+    if rec.keywords:
+        p('    {}'.format(button(rec.pmid, "kwds", "Keywords")))
+    if rec.chemicals:
+        p('    {}'.format(button(rec.pmid, "chem", "Chemicals")))
+    if rec.databases:
+        p('    {}'.format(button(rec.pmid, "xref", "DB Links")))
+    if rec.identifiers:
+        p('    {}'.format(button(rec.pmid, "ids", "Article IDs")))
+
+    if rec.descriptors:
+        p('    <dl class="mesh">')
+
+        for desc in rec.descriptors:
+            p('      <dt>{}</dt><dd><ol>'.format(formatMajor(desc)))
+
+            if desc.qualifiers:
+                for qual in desc.qualifiers:
+                    p('        <li>{}</li>'.format(formatMajor(qual)))
+
+            p('      </ol></dd>')
+        p('    </dl>')
+
+    if rec.chemicals:
+        p('    <ul class="chem">')
+
+        for chem in rec.chemicals:
+            p('      <li>{}{}</li>'.format(
+                chem.name,
+                "" if chem.uid is None else
+                " ({})".format(chem.uid)
+            ))
+
+        p('    </ul>')
+
+    if rec.keywords:
+        p('    <dl class="kwds">')
+        owner = None
+
+        for kwd in rec.keywords:
+            if kwd.owner != owner:
+                if owner is not None:
+                    p('        </dd>')
+
+                p('      <dt>{}</dt><dd>'.format(kwd.owner))
+                owner = kwd.owner
+
+            p('      <li>{}</li>'.format(formatMajor(kwd)))
+
+        p('    </dd></dl>')
+
+    if rec.databases:
+        p('    <ul class="xref">')
+
+        for xref in rec.databases:
+            try:
+                p('      <li>{} <a href="{}{}">{}</a></li>'.format(
+                    xref.name, DATABANK_LINK[xref.name],
+                    xref.accession, xref.accession
                 ))
-
-        p('  <div title="Metadata">')
-
-        if rec.descriptors:
-            p('    {}'.format(button(rec.pmid, "mesh", "MeSH Terms")))
-        if rec.keywords:
-            p('    {}'.format(button(rec.pmid, "kwds", "Keywords")))
-        if rec.chemicals:
-            p('    {}'.format(button(rec.pmid, "chem", "Chemicals")))
-        if rec.databases:
-            p('    {}'.format(button(rec.pmid, "xref", "DB Links")))
-        if rec.identifiers:
-            p('    {}'.format(button(rec.pmid, "ids", "Article IDs")))
-
-        if rec.descriptors:
-            p('    <dl class="mesh">')
-
-            for desc in rec.descriptors:
-                p('      <dt>{}</dt><dd><ol>'.format(formatMajor(desc)))
-
-                if desc.qualifiers:
-                    for qual in desc.qualifiers:
-                        p('        <li>{}</li>'.format(formatMajor(qual)))
-
-                p('      </ol></dd>')
-            p('    </dl>')
-
-        if rec.chemicals:
-            p('    <ul class="chem">')
-
-            for chem in rec.chemicals:
-                p('      <li>{}{}</li>'.format(
-                    chem.name,
-                    "" if chem.uid is None else
-                    " ({})".format(chem.uid)
+            except KeyError:
+                logging.error('unknown DB name: "{}"'.format(
+                    xref.name
                 ))
 
-            p('    </ul>')
-
-        if rec.keywords:
-            p('    <dl class="kwds">')
-            owner = None
-
-            for kwd in rec.keywords:
-                if kwd.owner != owner:
-                    if owner is not None:
-                        p('        </dd>')
-
-                    p('      <dt>{}</dt><dd>'.format(kwd.owner))
-                    owner = kwd.owner
+        p('    </ul>')
 
-                p('      <li>{}</li>'.format(formatMajor(kwd)))
+    if rec.identifiers:
+        p('    <ul class="ids">')
 
-            p('    </dd></dl>')
+        for ns, i in rec.identifiers.items():
+            if ns == 'doi':
+                p('      <li>{}</li>'.format(doi(i.value)))
+            elif ns == 'pmc':
+                p('      <li>{}</li>'.format(pmc(i.value)))
+            else:
+                p('      <li>{}:{}</li>'.format(ns, i.value))
 
-        if rec.databases:
-            p('    <ul class="xref">')
+        p('    </ul>')
 
-            for xref in rec.databases:
-                try:
-                    p('      <li>{} <a href="{}{}">{}</a></li>'.format(
-                        xref.name, DATABANK_LINK[xref.name],
-                        xref.accession, xref.accession
-                    ))
-                except KeyError:
-                    logging.error('unknown DB name: "{}"'.format(
-                        xref.name
-                    ))
-
-            p('    </ul>')
-
-        if rec.identifiers:
-            p('    <ul class="ids">')
+    p('  </div>\n</article><hr/>')
+    return file.getvalue()
 
-            for ns, i in rec.identifiers.items():
-                if ns == 'doi':
-                    p('      <li>{}</li>'.format(doi(i.value)))
-                elif ns == 'pmc':
-                    p('      <li>{}</li>'.format(pmc(i.value)))
-                else:
-                    p('      <li>{}:{}</li>'.format(ns, i.value))
 
-            p('    </ul>')
+def FormatIndex(pages: list) -> str:
+    """
+    Format an HTML index of numbered `pages`, a list of
+    ``(href, first_pmid, last_pmid, articles)`` tuples.
+    """
+    file = StringIO()
+    p = file.write
+    p("""<!doctype html>
+<html><head>
+  <meta charset="UTF-8"/>
+  <title>PubMed Articles</title>
+</head><body>
+  <h1>PubMed Articles</h1>
+  <ol>
+""")
+
+    for href, first, last, articles in pages:
+        p('    <li><a href="{}">PMID {} - {}</a> ({} articles)</li>\n'.format(
+            href, first, last, articles
+        ))
 
-        p('  </div>\n</article><hr/>')
-    p("""  <script>
-window.onload = function() {
-    toggleAll(document.getElementsByTagName("ul"))
-    toggleAll(document.getElementsByTagName("dl"))
-}
-  </script>
-</body></html>""")
+    p("""  </ol>
+</body></html>
+""")
     return file.getvalue()